@@ -1,76 +1,198 @@
 # ==========================
 # 2) grpc_client.py
 # ==========================
+import queue
 import grpc
+import numpy as np
 from . import inference_pb2
 from . import inference_pb2_grpc
 
 
+# The verify/finalize loop issues many small RPCs back to back on one
+# connection: keep it alive between bursts (and between prompts, when the
+# channel is cached idle) and give it its own subchannel instead of the
+# process-global pool.  Concurrent sessions already multiplex as
+# separate HTTP/2 streams on this one connection.
+CHANNEL_OPTIONS = [
+    ('grpc.max_send_message_length', 64 * 1024 * 1024),
+    ('grpc.max_receive_message_length', 64 * 1024 * 1024),
+    ('grpc.keepalive_time_ms', 20000),
+    ('grpc.keepalive_timeout_ms', 5000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.http2.min_time_between_pings_ms', 10000),
+    ('grpc.use_local_subchannel_pool', 1),
+]
+
+
+def create_channel(target_address):
+    return grpc.insecure_channel(target_address, options=CHANNEL_OPTIONS)
+
+
+def warm_channel(channel, timeout=5.0):
+    """
+    Block until `channel` has finished connecting so the first real RPC does
+    not pay the TCP/HTTP2 handshake.  Returns False if it is still not ready
+    after `timeout` seconds; the caller's first RPC then fails as before.
+    """
+    try:
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+        return True
+    except grpc.FutureTimeoutError:
+        return False
+
+
 def create_stub(target_address):
-    channel = grpc.insecure_channel(target_address)
+    channel = create_channel(target_address)
     stub = inference_pb2_grpc.SpeculativeServiceStub(channel)
     return stub
 
+# -----------------------------------------
+# PACKED TOKEN IDS
+# -----------------------------------------
+# StartRequest.prompt_token_ids travels as raw little-endian int32 bytes
+# (Llama-3's 128k vocab does not fit in 16 bits): one memcpy each way.
+_TOKEN_DTYPE = np.dtype('<i4')
+
+
+def pack_token_ids(token_ids):
+    return np.asarray(token_ids, dtype=_TOKEN_DTYPE).tobytes()
+
+
+def unpack_token_ids(buf):
+    return np.frombuffer(buf, dtype=_TOKEN_DTYPE).tolist()
+
+# -----------------------------------------
+# STREAMING CALLS
+# -----------------------------------------
+
+class _StreamCall:
+    """
+    Drive a stream-stream RPC as a sequence of request/response exchanges.
+    The stream is opened on the first call and kept open until close(), so
+    every round after the first skips the per-RPC HTTP/2 setup.
+    """
+    _END = object()
+
+    def __init__(self, method):
+        self._method = method
+        self._requests = None
+        self._responses = None
+
+    def __call__(self, request):
+        return self.future(request).result()
+
+    def future(self, request):
+        """
+        Send `request` now and return a handle whose result() waits for its
+        reply, like a unary stub's .future().  Replies arrive in request
+        order, so handles must be resolved in the order they were issued.
+        """
+        if self._responses is None:
+            self._requests = queue.Queue()
+            self._responses = self._method(iter(self._requests.get, self._END))
+        self._requests.put(request)
+        return _StreamReply(self._responses)
+
+    def close(self):
+        if self._responses is not None:
+            # ending the request iterator half-closes the stream
+            self._requests.put(self._END)
+            self._responses = None
+
+
+class _StreamReply:
+    __slots__ = ("_responses",)
+
+    def __init__(self, responses):
+        self._responses = responses
+
+    def result(self):
+        return next(self._responses)
+
+
+class VerifyStream:
+    """
+    Drop-in replacement for the stub in verify_draft_tokens (and therefore
+    speculative_decode) that sends every verification round of a session
+    over one VerifyDraftTokensStream.
+
+        with VerifyStream(stub) as stream:
+            speculative_decode(draft_model, tokenizer, stream, ...)
+    """
+    def __init__(self, stub):
+        self.VerifyDraftTokens = _StreamCall(stub.VerifyDraftTokensStream)
+
+    def close(self):
+        self.VerifyDraftTokens.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 # -----------------------------------------
 # BATCH-ORIENTED CLIENT CALLS
 # -----------------------------------------
 
 def verify_batch_tokens(stub, sequences):
     # sequences is a list of (session_id, [draft_tokens])
-    # build the request
-    seq_msgs = []
-    for s in sequences:
-        session_id, draft_toks = s
-        seq_msgs.append(
-            inference_pb2.DraftSequence(
-                session_id=session_id,
-                draft_tokens=draft_toks
-            )
-        )
-    request = inference_pb2.VerifyBatchRequest(sequences=seq_msgs)
+    # build the whole repeated field in one shot so protobuf copies each
+    # token list natively instead of appending message by message
+    request = inference_pb2.VerifyBatchRequest(sequences=[
+        inference_pb2.DraftSequence(session_id=session_id, draft_tokens=draft_toks)
+        for session_id, draft_toks in sequences
+    ])
     response = stub.VerifyBatchTokens(request)
     # returns a list of results
-    results = []
-    for r in response.results:
-        results.append({
+    return [
+        {
             'session_id': r.session_id,
             'tokens_accepted': r.tokens_accepted,
             'target_token': r.target_token,
             'finished': r.finished,
-        })
-    return results
+        }
+        for r in response.results
+    ]
 
 
 def finalize_batch_tokens(stub, sequences):
     # sequences is a list of (session_id, [accepted_tokens])
-    seq_msgs = []
-    for s in sequences:
-        session_id, tok_list = s
-        seq_msgs.append(
-            inference_pb2.FinalizeSequence(
-                session_id=session_id,
-                tokens=tok_list
-            )
-        )
-    request = inference_pb2.FinalizeBatchRequest(sequences=seq_msgs)
+    request = inference_pb2.FinalizeBatchRequest(sequences=[
+        inference_pb2.FinalizeSequence(session_id=session_id, tokens=tok_list)
+        for session_id, tok_list in sequences
+    ])
     response = stub.FinalizeBatchTokens(request)
-    results = []
-    for r in response.results:
-        results.append({
-            'session_id': r.session_id,
-            'finished': r.finished,
-        })
-    return results
+    return [
+        {'session_id': r.session_id, 'finished': r.finished}
+        for r in response.results
+    ]
 
 # -----------------------------------------
 # SINGLE-SEQUENCE CLIENT CALLS (existing)
 # -----------------------------------------
 
 def verify_draft_tokens(stub, draft_tokens, draft_probs, session_id=0):
+    return verify_draft_tokens_async(stub, draft_tokens, draft_probs, session_id)()
+
+
+def verify_draft_tokens_async(stub, draft_tokens, draft_probs, session_id=0):
+    """
+    Send the verify request without waiting for the reply, so the caller can
+    overlap local work with the round trip.  Returns a function that blocks
+    for the reply and unpacks it like verify_draft_tokens.
+    """
     request = inference_pb2.VerifyRequest(
         session_id   = session_id,
         draft_tokens = draft_tokens,
         draft_probs  = draft_probs,   # <<<
     )
-    resp = stub.VerifyDraftTokens(request)
-    return list(resp.committed_ids), resp.accepted_count, resp.finished
\ No newline at end of file
+    fut = stub.VerifyDraftTokens.future(request)
+
+    def wait():
+        resp = fut.result()
+        # committed_ids is handed back as the repeated-field container (it
+        # supports len/iteration/indexing) rather than boxed into a new list
+        return resp.committed_ids, resp.accepted_count, resp.finished
+    return wait
\ No newline at end of file
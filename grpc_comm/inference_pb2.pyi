@@ -0,0 +1,136 @@
+from google.protobuf.internal import containers as _containers
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
+
+DESCRIPTOR: _descriptor.FileDescriptor
+
+class StartRequest(_message.Message):
+    __slots__ = ("session_id", "prompt", "max_new_tokens", "gamma", "prompt_token_ids")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    PROMPT_FIELD_NUMBER: _ClassVar[int]
+    MAX_NEW_TOKENS_FIELD_NUMBER: _ClassVar[int]
+    GAMMA_FIELD_NUMBER: _ClassVar[int]
+    PROMPT_TOKEN_IDS_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    prompt: str
+    max_new_tokens: int
+    gamma: int
+    prompt_token_ids: bytes
+    def __init__(self, session_id: _Optional[int] = ..., prompt: _Optional[str] = ..., max_new_tokens: _Optional[int] = ..., gamma: _Optional[int] = ..., prompt_token_ids: _Optional[bytes] = ...) -> None: ...
+
+class StartResponse(_message.Message):
+    __slots__ = ("acknowledged",)
+    ACKNOWLEDGED_FIELD_NUMBER: _ClassVar[int]
+    acknowledged: bool
+    def __init__(self, acknowledged: bool = ...) -> None: ...
+
+class DraftSequence(_message.Message):
+    __slots__ = ("session_id", "draft_tokens", "draft_probs")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    DRAFT_TOKENS_FIELD_NUMBER: _ClassVar[int]
+    DRAFT_PROBS_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    draft_tokens: _containers.RepeatedScalarFieldContainer[int]
+    draft_probs: _containers.RepeatedScalarFieldContainer[float]
+    def __init__(self, session_id: _Optional[int] = ..., draft_tokens: _Optional[_Iterable[int]] = ..., draft_probs: _Optional[_Iterable[float]] = ...) -> None: ...
+
+class VerifyBatchRequest(_message.Message):
+    __slots__ = ("sequences",)
+    SEQUENCES_FIELD_NUMBER: _ClassVar[int]
+    sequences: _containers.RepeatedCompositeFieldContainer[DraftSequence]
+    def __init__(self, sequences: _Optional[_Iterable[_Union[DraftSequence, _Mapping]]] = ...) -> None: ...
+
+class VerifyRequest(_message.Message):
+    __slots__ = ("session_id", "draft_tokens", "draft_probs")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    DRAFT_TOKENS_FIELD_NUMBER: _ClassVar[int]
+    DRAFT_PROBS_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    draft_tokens: _containers.RepeatedScalarFieldContainer[int]
+    draft_probs: _containers.RepeatedScalarFieldContainer[float]
+    def __init__(self, session_id: _Optional[int] = ..., draft_tokens: _Optional[_Iterable[int]] = ..., draft_probs: _Optional[_Iterable[float]] = ...) -> None: ...
+
+class VerifyResult(_message.Message):
+    __slots__ = ("session_id", "tokens_accepted", "target_token", "finished")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    TOKENS_ACCEPTED_FIELD_NUMBER: _ClassVar[int]
+    TARGET_TOKEN_FIELD_NUMBER: _ClassVar[int]
+    FINISHED_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    tokens_accepted: int
+    target_token: int
+    finished: bool
+    def __init__(self, session_id: _Optional[int] = ..., tokens_accepted: _Optional[int] = ..., target_token: _Optional[int] = ..., finished: bool = ...) -> None: ...
+
+class VerifyBatchResponse(_message.Message):
+    __slots__ = ("results",)
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    results: _containers.RepeatedCompositeFieldContainer[VerifyResult]
+    def __init__(self, results: _Optional[_Iterable[_Union[VerifyResult, _Mapping]]] = ...) -> None: ...
+
+class FinalizeSequence(_message.Message):
+    __slots__ = ("session_id", "tokens")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    TOKENS_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    tokens: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, session_id: _Optional[int] = ..., tokens: _Optional[_Iterable[int]] = ...) -> None: ...
+
+class FinalizeBatchRequest(_message.Message):
+    __slots__ = ("sequences",)
+    SEQUENCES_FIELD_NUMBER: _ClassVar[int]
+    sequences: _containers.RepeatedCompositeFieldContainer[FinalizeSequence]
+    def __init__(self, sequences: _Optional[_Iterable[_Union[FinalizeSequence, _Mapping]]] = ...) -> None: ...
+
+class FinalizeBatchResult(_message.Message):
+    __slots__ = ("session_id", "finished")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    FINISHED_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    finished: bool
+    def __init__(self, session_id: _Optional[int] = ..., finished: bool = ...) -> None: ...
+
+class FinalizeBatchResponse(_message.Message):
+    __slots__ = ("results",)
+    RESULTS_FIELD_NUMBER: _ClassVar[int]
+    results: _containers.RepeatedCompositeFieldContainer[FinalizeBatchResult]
+    def __init__(self, results: _Optional[_Iterable[_Union[FinalizeBatchResult, _Mapping]]] = ...) -> None: ...
+
+class VerifyResponse(_message.Message):
+    __slots__ = ("committed_ids", "accepted_count", "finished")
+    COMMITTED_IDS_FIELD_NUMBER: _ClassVar[int]
+    ACCEPTED_COUNT_FIELD_NUMBER: _ClassVar[int]
+    FINISHED_FIELD_NUMBER: _ClassVar[int]
+    committed_ids: _containers.RepeatedScalarFieldContainer[int]
+    accepted_count: int
+    finished: bool
+    def __init__(self, committed_ids: _Optional[_Iterable[int]] = ..., accepted_count: _Optional[int] = ..., finished: bool = ...) -> None: ...
+
+class FinalizeRequest(_message.Message):
+    __slots__ = ("session_id", "accepted_count", "draft_chunk_size")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    ACCEPTED_COUNT_FIELD_NUMBER: _ClassVar[int]
+    DRAFT_CHUNK_SIZE_FIELD_NUMBER: _ClassVar[int]
+    session_id: int
+    accepted_count: int
+    draft_chunk_size: int
+    def __init__(self, session_id: _Optional[int] = ..., accepted_count: _Optional[int] = ..., draft_chunk_size: _Optional[int] = ...) -> None: ...
+
+class FinalizeResponse(_message.Message):
+    __slots__ = ("final_token", "finished")
+    FINAL_TOKEN_FIELD_NUMBER: _ClassVar[int]
+    FINISHED_FIELD_NUMBER: _ClassVar[int]
+    final_token: int
+    finished: bool
+    def __init__(self, final_token: _Optional[int] = ..., finished: bool = ...) -> None: ...
+
+class GenerateRequest(_message.Message):
+    __slots__ = ()
+    def __init__(self) -> None: ...
+
+class GenerateResponse(_message.Message):
+    __slots__ = ("output_text",)
+    OUTPUT_TEXT_FIELD_NUMBER: _ClassVar[int]
+    output_text: str
+    def __init__(self, output_text: _Optional[str] = ...) -> None: ...
@@ -55,6 +55,11 @@ class SpeculativeServiceStub(object):
                 request_serializer=inference__pb2.VerifyRequest.SerializeToString,
                 response_deserializer=inference__pb2.VerifyResponse.FromString,
                 _registered_method=True)
+        self.VerifyDraftTokensStream = channel.stream_stream(
+                '/specdecode.SpeculativeService/VerifyDraftTokensStream',
+                request_serializer=inference__pb2.VerifyRequest.SerializeToString,
+                response_deserializer=inference__pb2.VerifyResponse.FromString,
+                _registered_method=True)
         self.FinalizeTokens = channel.unary_unary(
                 '/specdecode.SpeculativeService/FinalizeTokens',
                 request_serializer=inference__pb2.FinalizeRequest.SerializeToString,
@@ -97,6 +102,14 @@ class SpeculativeServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def VerifyDraftTokensStream(self, request_iterator, context):
+        """Streaming VerifyDraftTokens: one stream per session carries every
+        gamma-chunk verification round.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def FinalizeTokens(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -133,6 +146,11 @@ def add_SpeculativeServiceServicer_to_server(servicer, server):
                     request_deserializer=inference__pb2.VerifyRequest.FromString,
                     response_serializer=inference__pb2.VerifyResponse.SerializeToString,
             ),
+            'VerifyDraftTokensStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.VerifyDraftTokensStream,
+                    request_deserializer=inference__pb2.VerifyRequest.FromString,
+                    response_serializer=inference__pb2.VerifyResponse.SerializeToString,
+            ),
             'FinalizeTokens': grpc.unary_unary_rpc_method_handler(
                     servicer.FinalizeTokens,
                     request_deserializer=inference__pb2.FinalizeRequest.FromString,
@@ -263,6 +281,33 @@ class SpeculativeService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def VerifyDraftTokensStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/specdecode.SpeculativeService/VerifyDraftTokensStream',
+            inference__pb2.VerifyRequest.SerializeToString,
+            inference__pb2.VerifyResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def FinalizeTokens(request,
             target,
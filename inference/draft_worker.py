@@ -1,26 +1,129 @@
+import atexit
 import logging
-import grpc
 import os
+import sys
 import time
 import json
 import threading
-import uuid
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from grpc_comm import inference_pb2_grpc, inference_pb2, grpc_client
 from inference.model_loader import load_model
 from inference.speculative import speculative_decode
 from transformers import AutoTokenizer
-import torch
+
+try:
+    import orjson   # optional: faster perf snapshots when installed
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Perf files are written by a single background thread so disk I/O never
+# sits between back-to-back runs; one worker also keeps CSV appends ordered.
+_perf_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="perf-writer")
+atexit.register(_perf_pool.shutdown, wait=True)
+
+# One channel + stub per target address, shared by every run in the process
+# so repeated runs skip the TCP/HTTP2 handshake.  Closed at exit.
+_stub_cache = {}
+_stub_lock = threading.Lock()
+
+
+def _get_stub(target_host: str, port: int):
+    key = (target_host, port)
+    with _stub_lock:
+        entry = _stub_cache.get(key)
+        created = entry is None
+        if created:
+            channel = grpc_client.create_channel(f"{target_host}:{port}")
+            entry = (channel, inference_pb2_grpc.SpeculativeServiceStub(channel))
+            _stub_cache[key] = entry
+    # warm outside the lock: the wait can take seconds, and callers for other
+    # targets (or this one, whose first RPC just waits for the connection)
+    # need not queue behind it
+    if created and not grpc_client.warm_channel(entry[0]):
+        logger.warning(f"Target server at {target_host}:{port} not reachable yet.")
+    return entry[1]
+
+
+@atexit.register
+def _close_channels():
+    with _stub_lock:
+        for channel, _ in _stub_cache.values():
+            channel.close()
+        _stub_cache.clear()
+
+
+# A long-lived worker handed several prompt files loads the compiled draft
+# and its tokenizer once.  Every run re-primes the draft KV pointer
+# (speculative_decode resets cache_ids/_next_pos) while holding the model's
+# session_lock, so reuse is safe.
+def _load_draft_model(model_path: str, sequence_length: int, spec_length: int, quantize: str = None):
+    # DRAFT_QUANT=int8 turns on int8 draft weights when no kwarg is given
+    quantize = quantize or os.environ.get("DRAFT_QUANT") or None
+    return _load_draft_model_cached(model_path, sequence_length, spec_length, quantize)
+
+
+@lru_cache(maxsize=4)
+def _load_draft_model_cached(model_path: str, sequence_length: int, spec_length: int, quantize):
+    return load_model(model_path, sequence_length=sequence_length, spec_length=spec_length,
+                      quantize=quantize)
+
+
+@lru_cache(maxsize=4)
+def _load_tokenizer(source: str):
+    return AutoTokenizer.from_pretrained(source, use_fast=False)
+
+
+def _start_session(stub, tokenizer, prompt: str, max_new_tokens: int, gamma: int):
+    """
+    Open a target session for `prompt` and return (session_id, prompt_ids).
+    The prompt is tokenized once here: the ids go to the server, which primes
+    its KV cache from them directly, and back to the caller for
+    speculative_decode.
+    """
+    session_id = _gen_session_id()
+    prompt_ids = tokenizer(prompt, return_tensors='pt').input_ids
+    resp = stub.StartGeneration(
+        inference_pb2.StartRequest(
+            session_id=session_id,
+            prompt_token_ids=grpc_client.pack_token_ids(prompt_ids[0]),
+            max_new_tokens=max_new_tokens,
+            gamma=gamma
+        )
+    )
+    if not resp.acknowledged:
+        # the first verify then reports the session finished
+        logger.warning(f"[session={session_id}] target rejected the prompt (empty after tokenization)")
+    return session_id, prompt_ids
+
+
+def _read_prompts(prompt_text_file: str):
+    """Return the non-empty, stripped lines of `prompt_text_file` ([] on error)."""
+    if not os.path.exists(prompt_text_file):
+        logger.error(f"Prompt text file not found: {prompt_text_file}")
+        return []
+    # one read + splitlines rather than iterating the file line by line
+    with open(prompt_text_file, 'rb') as f:
+        data = f.read()
+    prompts = [ln.decode('utf-8').strip() for ln in data.splitlines() if ln.strip()]
+    if not prompts:
+        logger.error("No valid lines in the prompt file.")
+    return prompts
+
 
 def save_perf_stats(perf_stats: dict, file_prefix: str):
     """
     Save perf_stats to <file_prefix>.csv (append a row) and
     <file_prefix>.json (overwrite latest snapshot).
+    The write is queued on a background thread and this returns immediately.
     """
+    return _perf_pool.submit(_write_perf_stats, dict(perf_stats), file_prefix)
+
+
+def _write_perf_stats(perf_stats: dict, file_prefix: str):
     csv_path  = f"{file_prefix}.csv"
     json_path = f"{file_prefix}.json"
     try:
@@ -41,8 +144,6 @@ def save_perf_stats(perf_stats: dict, file_prefix: str):
 
         write_header = not os.path.exists(csv_path)
         with open(csv_path, "a", newline='') as cf:
-            if write_header:
-                cf.write(",".join(header) + "\n")
             row = [
                 f"{total_time_val:.3f}",
                 perf_stats.get("tokens_generated", ""),
@@ -54,11 +155,17 @@ def save_perf_stats(perf_stats: dict, file_prefix: str):
                 fmt(perf_stats.get("target_verification_time", 0.0)),
                 fmt(perf_stats.get("rollback_time", 0.0)),
             ]
-            cf.write(",".join(str(x) for x in row) + "\n")
+            line = ",".join(str(x) for x in row) + "\n"
+            # header (if new) and row go out in a single write
+            cf.write(",".join(header) + "\n" + line if write_header else line)
 
         # Always dump latest JSON snapshot
-        with open(json_path, "w") as jf:
-            json.dump(perf_stats, jf, indent=2)
+        if orjson is not None:
+            payload = orjson.dumps(perf_stats, option=orjson.OPT_INDENT_2)
+        else:
+            payload = json.dumps(perf_stats, indent=2).encode()
+        with open(json_path, "wb") as jf:
+            jf.write(payload)
         logger.info(f"Perf metrics appended to {csv_path} (snapshot {json_path})")
     except Exception as e:
         logger.error(f"Failed to save performance data: {e}")
@@ -75,25 +182,17 @@ def run_batched_prompt_file(
     gamma: int = 4,
     profile: bool = False,
     top_p: float = 0.9,
-    temperature: float = 1.0
+    temperature: float = 1.0,
+    quantize: str = None
 ):
-    if not os.path.exists(prompt_text_file):
-        logger.error(f"Prompt text file not found: {prompt_text_file}")
-        return
-    with open(prompt_text_file, 'r', encoding='utf-8') as f:
-        prompts = [line.strip() for line in f if line.strip()]
+    prompts = _read_prompts(prompt_text_file)
     if not prompts:
-        logger.error("No valid lines in the prompt file.")
         return
 
     logger.info(f"Loading draft model '{draft_model_name}' (sequence_length={sequence_length}) for batched decoding...")
     if isinstance(draft_model_name, str):
         # draft_model_name is a path → load the model
-        draft_model = load_model(
-            draft_model_name,
-            sequence_length=sequence_length,
-            spec_length=gamma
-        )
+        draft_model = _load_draft_model(draft_model_name, sequence_length, gamma, quantize)
         model_path_str = draft_model_name
     else:
         # never happens in Neuron
@@ -112,60 +211,39 @@ def run_batched_prompt_file(
             "Cannot determine tokenizer_source: provide --target_tokenizer when "
             "passing a pre‑loaded draft model."
         )
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_source, use_fast=False)
+    tokenizer = _load_tokenizer(tokenizer_source)
     
-    address = f"{target_host}:{port}"
-    channel = grpc.insecure_channel(address)
-    stub = inference_pb2_grpc.SpeculativeServiceStub(channel)
-
-    # We'll create a single session_id for each prompt, or we can unify them.
-    # For now, let's do one session per prompt, but handle them in a single pass.
-
-    # Step 1) StartGeneration for each prompt
-    session_ids = []
-    for prompt in prompts:
-        sid = _gen_session_id()
-        session_ids.append(sid)
-        stub.StartGeneration(
-            inference_pb2.StartRequest(
-                session_id=sid,
-                prompt=prompt,
-                max_new_tokens=max_new_tokens,
-                gamma=gamma
-            )
-        )
-
-    final_texts = [prompts[i] for i in range(len(prompts))]
-    finished_mask = [False]*len(prompts)
-    tokens_generated = [0]*len(prompts)
-    accepted_counts = [0]*len(prompts)
-    target_counts = [0]*len(prompts)
+    stub = _get_stub(target_host, port)
 
-    # do up to max_new_tokens steps in batch
-    import time
-    start_time = time.time()
+    # One session per prompt, decoded back to back.  Both compiled models are
+    # batch-1 with a single KV cache, and StartGeneration primes the target
+    # cache for its prompt, so each session is started right before it is
+    # decoded (starting them all up front would leave the target cache
+    # holding only the last prompt).
+    final_texts = list(prompts)
+    start_ns = time.perf_counter_ns()
 
-    # a loop in Python that calls speculative_decode for each prompt in sequence
     for i, prompt in enumerate(prompts):
+        session_id, prompt_ids = _start_session(stub, tokenizer, prompt, max_new_tokens, gamma)
         logger.info(f"[BATCH] Decoding prompt {i}: {prompt}")
-        gen_text, perf_stats = speculative_decode(
-            draft_model, tokenizer, stub,
-            prompt, max_new_tokens, gamma,
-            profile=profile, top_p=top_p, temperature=temperature,
-            session_id=session_ids[i]
-        )
+        # every verify round of this session rides one stream
+        with grpc_client.VerifyStream(stub) as stream:
+            gen_text, perf_stats = speculative_decode(
+                draft_model, tokenizer, stream,
+                prompt, max_new_tokens, gamma,
+                profile=profile, top_p=top_p, temperature=temperature,
+                session_id=session_id,
+                prompt_ids=prompt_ids
+            )
         final_texts[i] = prompt + gen_text
         if perf_stats:
-            accepted_counts[i] = perf_stats.get("accepted_tokens_total", 0)
-            target_counts[i] = perf_stats.get("target_tokens_total", 0)
             if profile:
                 # Record prompt index so rows can be distinguished, but
                 # append all rows to a single CSV file.
                 perf_stats["prompt_id"] = i
                 save_perf_stats(perf_stats, file_prefix="performance_speculative")
 
-    end_time = time.time()
-    total_time = end_time - start_time
+    total_time = (time.perf_counter_ns() - start_ns) / 1e9
     logger.info(f"Batched decode completed in {total_time:.2f}s.")
 
     print("\n=== Final Outputs (BATCH approach) ===")
@@ -184,41 +262,32 @@ def run_client(draft_model_name: str,
                profile: bool = False,
                no_target: bool = False,
                top_p: float = 0.9,
-               temperature: float = 1.0):
+               temperature: float = 1.0,
+               quantize: str = None):
     # same as existing
     logger.info(f"Loading draft model '{draft_model_name}' (sequence_length={sequence_length})...")
-    draft_model = load_model(
-        draft_model_name,
-        sequence_length=sequence_length,
-        spec_length=gamma
-    )
+    draft_model = _load_draft_model(draft_model_name, sequence_length, gamma, quantize)
     tokenizer_source = target_tokenizer or draft_model_name
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_source, use_fast=False)
+    tokenizer = _load_tokenizer(tokenizer_source)
     if not prompt:
         logger.error("No prompt provided.")
         return
     if no_target:
-        return _run_standalone_draft(draft_model, tokenizer, prompt, max_new_tokens, profile)
+        return _run_standalone_draft(draft_model, tokenizer, prompt, max_new_tokens, profile,
+                                     sequence_length)
     else:
-        address = f"{target_host}:{port}"
-        logger.info(f"Connecting to target server at {address}...")
-        channel = grpc.insecure_channel(address)
-        stub = inference_pb2_grpc.SpeculativeServiceStub(channel)
-        session_id = _gen_session_id()
-        stub.StartGeneration(
-            inference_pb2.StartRequest(
+        logger.info(f"Connecting to target server at {target_host}:{port}...")
+        stub = _get_stub(target_host, port)
+        session_id, prompt_ids = _start_session(stub, tokenizer, prompt, max_new_tokens, gamma)
+        logger.info(f"Starting speculative decoding (single) for prompt: '{prompt}'")
+        # every verify round of this session rides one stream
+        with grpc_client.VerifyStream(stub) as stream:
+            generated_text, perf_stats = speculative_decode(
+                draft_model, tokenizer, stream, prompt, max_new_tokens, gamma,
+                profile=profile, top_p=top_p, temperature=temperature,
                 session_id=session_id,
-                prompt=prompt,
-                max_new_tokens=max_new_tokens,
-                gamma=gamma
+                prompt_ids=prompt_ids
             )
-        )
-        logger.info(f"Starting speculative decoding (single) for prompt: '{prompt}'")
-        generated_text, perf_stats = speculative_decode(
-            draft_model, tokenizer, stub, prompt, max_new_tokens, gamma,
-            profile=profile, top_p=top_p, temperature=temperature,
-            session_id=session_id
-        )
         full_output = prompt + generated_text
         print("\n=== Final Output ===\n" + full_output)
         if profile and perf_stats:
@@ -226,37 +295,43 @@ def run_client(draft_model_name: str,
         return full_output
 
 
-def _run_standalone_draft(draft_model, tokenizer, prompt, max_new_tokens, profile):
-    # same as existing
-    output_text = ""
+def _run_standalone_draft(draft_model, tokenizer, prompt, max_new_tokens, profile,
+                          sequence_length):
+    # same as existing, but all tokens come from ONE sample() call: generate()
+    # threads its KV cache through the new tokens, whereas every further
+    # call would re-prefill the whole context from slot 0
     input_ids = tokenizer(prompt, return_tensors='pt').input_ids
-    tokens_generated = 0
-    start_time = time.time() if profile else None
-    for i in range(max_new_tokens):
-        try:
-            output = draft_model.sample(input_ids, sequence_length=input_ids.shape[1] + 1)
-        except Exception as e:
-            logger.error(f"Draft model generation failed: {e}")
-            break
-        token_id = int(output[0, -1]) if not isinstance(output, (list, tuple)) else int(output[0][-1])
-        token_text = tokenizer.decode([token_id], clean_up_tokenization_spaces=False)
-        output_text += token_text
-        new_token_tensor = torch.tensor([[token_id]], dtype=input_ids.dtype)
-        input_ids = torch.cat([input_ids, new_token_tensor], dim=1)
-        tokens_generated += 1
-        if tokenizer.eos_token_id is not None and token_id == tokenizer.eos_token_id:
-            break
-    end_time = time.time() if profile else None
-    if profile and start_time is not None:
-        total_time = end_time - start_time
+    prompt_len = input_ids.shape[1]
+    # token ids are detokenized once at the end
+    generated_ids = []
+    eos_id = tokenizer.eos_token_id
+    # never ask for more positions than the model was compiled with
+    # (n_positions=sequence_length); keep whatever fits instead of failing
+    total_len = min(prompt_len + max_new_tokens, sequence_length)
+    if total_len < prompt_len + max_new_tokens:
+        logger.warning(f"Prompt ({prompt_len} tokens) + max_new_tokens={max_new_tokens} exceeds "
+                       f"sequence_length={sequence_length}; generating {max(0, total_len - prompt_len)} tokens.")
+    start_ns = time.perf_counter_ns() if profile else None
+    try:
+        output = draft_model.sample(input_ids, sequence_length=total_len)
+        generated_ids = output[0, prompt_len:prompt_len + max_new_tokens].tolist()
+    except Exception as e:
+        logger.error(f"Draft model generation failed: {e}")
+    if eos_id is not None and eos_id in generated_ids:
+        generated_ids = generated_ids[:generated_ids.index(eos_id) + 1]
+    tokens_generated = len(generated_ids)
+    if profile and start_ns is not None:
+        total_time = (time.perf_counter_ns() - start_ns) / 1e9
         throughput = tokens_generated / total_time if total_time > 0 else float('inf')
         logger.info(f"Draft model generation completed in {total_time:.2f} seconds. Throughput={throughput:.2f} t/s")
+    output_text = tokenizer.decode(generated_ids, clean_up_tokenization_spaces=False)
     full_output = prompt + output_text
-    print("\n=== Final Output ===\n" + full_output)
+    sys.stdout.write("\n=== Final Output ===\n" + full_output + "\n")
+    sys.stdout.flush()
     return full_output
 
 
-def run_concurrent_clients(draft_model_name: str,
+def run_sequential_clients(draft_model_name: str,
                            target_host: str = "localhost",
                            port: int = 50051,
                            prompt_text_file: str = "",
@@ -267,73 +342,68 @@ def run_concurrent_clients(draft_model_name: str,
                            profile: bool = False,
                            no_target: bool = False,
                            top_p: float = 0.9,
-                           temperature: float = 1.0):
-    # same as existing concurrency approach
-    if not os.path.exists(prompt_text_file):
-        logger.error(f"Prompt text file not found: {prompt_text_file}")
-        return
-    with open(prompt_text_file, 'r', encoding='utf-8') as f:
-        prompts = [line.strip() for line in f if line.strip()]
+                           temperature: float = 1.0,
+                           quantize: str = None):
+    """
+    Decode every prompt in `prompt_text_file`, one session after another.
+    The draft and target each hold a single batch-1 KV cache, and
+    StartGeneration re-primes the target's from slot 0, so sessions cannot
+    overlap.
+    """
+    prompts = _read_prompts(prompt_text_file)
     if not prompts:
-        logger.error("No valid lines in prompt file.")
         return
-    logger.info(f"Loading draft model '{draft_model_name}' (sequence_length={sequence_length}) for concurrency...")
-    draft_model = load_model(
-        draft_model_name,
-        sequence_length=sequence_length,
-        spec_length=gamma
-    )
+    logger.info(f"Loading draft model '{draft_model_name}' (sequence_length={sequence_length}) for sequential sessions...")
+    draft_model = _load_draft_model(draft_model_name, sequence_length, gamma, quantize)
     tokenizer_source = target_tokenizer or draft_model_name
-    tokenizer = AutoTokenizer.from_pretrained(tokenizer_source, use_fast=False)
-    address = f"{target_host}:{port}"
-    channel = None
+    tokenizer = _load_tokenizer(tokenizer_source)
     stub = None
     if not no_target:
-        logger.info(f"Connecting to target server at {address} for concurrency...")
-        channel = grpc.insecure_channel(address)
-        stub = inference_pb2_grpc.SpeculativeServiceStub(channel)
-    results = [None]*len(prompts)
-    threads = []
+        logger.info(f"Connecting to target server at {target_host}:{port} for sequential sessions...")
+        stub = _get_stub(target_host, port)
 
     def worker(idx, prompt_text):
         if no_target:
-            out = _run_standalone_draft(draft_model, tokenizer, prompt_text, max_new_tokens, profile)
-            results[idx] = out
+            return _run_standalone_draft(draft_model, tokenizer, prompt_text, max_new_tokens, profile,
+                                         sequence_length)
         else:
-            session_id = _gen_session_id()
-            stub.StartGeneration(
-                inference_pb2.StartRequest(
+            session_id, prompt_ids = _start_session(stub, tokenizer, prompt_text, max_new_tokens, gamma)
+            logger.info(f"[Prompt-{idx}] Starting speculative decoding with session_id={session_id}")
+            # every verify round of this session rides one stream
+            with grpc_client.VerifyStream(stub) as stream:
+                gen_text, perf_stats = speculative_decode(
+                    draft_model, tokenizer, stream,
+                    prompt_text, max_new_tokens, gamma,
+                    profile=profile, top_p=top_p, temperature=temperature,
                     session_id=session_id,
-                    prompt=prompt_text,
-                    max_new_tokens=max_new_tokens,
-                    gamma=gamma
+                    prompt_ids=prompt_ids
                 )
-            )
-            logger.info(f"[Thread-{idx}] Starting speculative decoding with session_id={session_id}")
-            gen_text, perf_stats = speculative_decode(
-                draft_model, tokenizer, stub,
-                prompt_text, max_new_tokens, gamma,
-                profile=profile, top_p=top_p, temperature=temperature,
-                session_id=session_id
-            )
             full_output = prompt_text + gen_text
-            results[idx] = full_output
             if profile and perf_stats:
                 prefix = f"performance_speculative_prompt{idx}"
                 save_perf_stats(perf_stats, file_prefix=prefix)
+            return full_output
 
-    for i, prompt_text in enumerate(prompts):
-        t = threading.Thread(target=worker, args=(i, prompt_text), daemon=True)
-        threads.append(t)
-        t.start()
-
-    for t in threads:
-        t.join()
+    # one at a time, in prompt order (see the docstring)
+    results = [worker(idx, prompt_text) for idx, prompt_text in enumerate(prompts)]
 
     print("\n=== Final Batched Outputs ===")
     for i, text in enumerate(results):
         print(f"\n[Prompt {i} Output]:\n{text}")
 
 
+# 32-bit xorshift for session ids, seeded per process from the clock and pid
+# (never 0, which is a fixed point).  Cheaper than drawing a uuid4 per id.
+_sid_state = ((time.time_ns() ^ (os.getpid() << 16)) & 0xFFFFFFFF) or 0x9E3779B9
+_sid_lock = threading.Lock()
+
+
 def _gen_session_id():
-    return int(uuid.uuid4()) & 0xFFFFFFFF
\ No newline at end of file
+    global _sid_state
+    with _sid_lock:
+        s = _sid_state
+        s ^= (s << 13) & 0xFFFFFFFF
+        s ^= s >> 17
+        s ^= (s << 5) & 0xFFFFFFFF
+        _sid_state = s
+        return s
\ No newline at end of file
@@ -3,12 +3,13 @@ import logging
 import shutil
 import re
 import json
+import threading
 from transformers import AutoModelForCausalLM, AutoTokenizer, AutoConfig
 from transformers_neuronx import LlamaForSampling
 from transformers_neuronx.module import save_pretrained_split
 from transformers_neuronx.generation_utils import HuggingFaceGenerationModelAdapter
 import torch
-from transformers_neuronx.config import NeuronConfig
+from transformers_neuronx.config import NeuronConfig, QuantizationConfig
 from transformers.modeling_outputs import CausalLMOutputWithPast
 from transformers_neuronx.fused_speculation import FusedSpeculativeDecoder
 import types
@@ -28,7 +29,13 @@ class NeuronHFAdapterWrap(torch.nn.Module):
         self.adapter = adapter
         self.cache_ids = None  # Initialize KV cache pointer storage
         self._next_pos = 0  # next position index in the KV cache
+        self._primed_ids = ()  # prompt prefix cached at slots 0… (see speculative_decode)
+        # batch 1, one KV cache: held by whoever is decoding into it
+        # (a speculative_decode session or a sample() call) from start to end
+        self.session_lock = threading.Lock()
         self.config = adapter.config
+        # reusable (1,) position tensor for the single-token decode step
+        self._decode_pos = torch.zeros(1, dtype=torch.int32)
 
     # ------------------------------------------------------------------  
     # helper: build a (batch, length) int32 tensor [start, …, start+L‑1]  
@@ -87,7 +94,14 @@ class NeuronHFAdapterWrap(torch.nn.Module):
         # ------------------------------------------------------------------
         # Decide which position tensor to pass for these L new tokens
         # ------------------------------------------------------------------
-        if cache_ids is None:
+        if cache_ids is None and B == 1 and L == 1 and self._next_pos > 0:
+            # Hot decode step: the graph signature is fixed at (1,1) with a
+            # (1,) position, so write the slot into the reused tensor
+            # instead of building and squeezing a fresh one every token.
+            self._decode_pos[0] = self._next_pos
+            pos_tensor = self._decode_pos
+            next_pos_after = self._next_pos + 1
+        elif cache_ids is None:
             if self._next_pos == 0:
                 # First (prompt‑priming) call – let Neuron allocate 0…L‑1
                 pos_tensor = None                    # Neuron fills it
@@ -124,7 +138,12 @@ class NeuronHFAdapterWrap(torch.nn.Module):
             if pos_tensor.ndim == 2 and pos_tensor.size(0) == 1 and pos_tensor.size(1) == 1:
                 pos_tensor = pos_tensor.squeeze(0)
         # self.cache_ids = pos_tensor if pos_tensor.ndim == 1 else pos_tensor.squeeze(0)
-        self.cache_ids = torch.tensor([self._next_pos], dtype=torch.int32)
+        # Callers install their own copy (clone / fresh tensor) before
+        # forward, so the pointer can be updated in place.
+        if self.cache_ids is not None and self.cache_ids.shape == (1,):
+            self.cache_ids[0] = self._next_pos
+        else:
+            self.cache_ids = torch.tensor([self._next_pos], dtype=torch.int32)
 
         # ------------------------------------------------------------------
         # Unpack logits to 1‑D tensor
@@ -141,6 +160,9 @@ class NeuronHFAdapterWrap(torch.nn.Module):
         if logits.dim() == 2:
             logits = logits[0]
 
+        if pos_tensor is self._decode_pos:
+            # the reused buffer is rewritten next step; hand out a copy
+            pos_tensor = pos_tensor.clone()
         return logits, pos_tensor
 
     # ------------------------------------------------------------------
@@ -163,34 +185,45 @@ class NeuronHFAdapterWrap(torch.nn.Module):
         if num_new == 0:
             return input_ids
 
-        out = self.adapter.generate(
-            input_ids,
-            max_new_tokens=num_new,
-            do_sample=do_sample,
-            temperature=temperature,
-            top_p=top_p,
-            eos_token_id=self.config.eos_token_id,
-        )
+        with self.session_lock:
+            self._primed_ids = ()  # generate() rewrites the cache from slot 0
+            out = self.adapter.generate(
+                input_ids,
+                max_new_tokens=num_new,
+                do_sample=do_sample,
+                temperature=temperature,
+                top_p=top_p,
+                eos_token_id=self.config.eos_token_id,
+            )
         return out
 
+
 # Default sequence length (can be overridden by function arguments)
 DEFAULT_SEQUENCE_LENGTH = 128
 
-def load_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGTH, spec_length: int = None):
+def load_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGTH, spec_length: int = None,
+               quantize: str = None):
     """
     Load or compile a model for inference.
     """
     logger.info(f"Attempting to download/compile from source.")
-    model = compile_model(model_path, sequence_length=sequence_length, spec_length=spec_length)
+    model = compile_model(model_path, sequence_length=sequence_length, spec_length=spec_length,
+                          quantize=quantize)
     return model
 
-def compile_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGTH, spec_length: int = None):
+def compile_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGTH, spec_length: int = None,
+                  quantize: str = None):
     """
     Compile a model for AWS Neuron. Loads the model (from HF Hub or local checkpoint),
     compiles it to a TorchScript that can run on NeuronCores, and saves the compiled model
     and tokenizer to a local folder for future use.
+    quantize="int8" keeps the weights in int8 (dequantised to bf16 inside the
+    kernels), halving the weight bandwidth of each decode step.  It applies to
+    the Neuron LLaMA path only and is ignored, with a warning, otherwise.
     """
-    logger.info(f"Compiling model '{model_path}' to Neuron (sequence_length={sequence_length})...")
+    if quantize not in (None, "int8"):
+        raise ValueError(f"Unsupported quantize={quantize!r}; expected None or 'int8'")
+    logger.info(f"Compiling model '{model_path}' to Neuron (sequence_length={sequence_length}, quantize={quantize})...")
 
     model_type = ""
     try:
@@ -207,6 +240,10 @@ def compile_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGT
     tp_degree = int(os.environ.get("NEURON_RT_NUM_CORES", "2"))
     if model_type.lower() == "llama" or "llama" in model_path.lower():
         logger.info(f"Compiling model using optimized LLaMA for Neuron ...")
+        neuron_cfg = None
+        if quantize == "int8":
+            neuron_cfg = NeuronConfig(
+                quant=QuantizationConfig(quant_dtype="s8", dequant_dtype="bf16"))
         model = LlamaForSampling.from_pretrained(
             model_path,
             batch_size=1,
@@ -214,6 +251,7 @@ def compile_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGT
             n_positions=sequence_length,
             context_length_estimate=sequence_length,
             spec_length = spec_length,
+            neuron_config=neuron_cfg,
             tp_degree=tp_degree,
             on_device_generation=False,
             return_all_logits=True,
@@ -273,8 +311,13 @@ def compile_model(model_path: str, sequence_length: int = DEFAULT_SEQUENCE_LENGT
         # )
 
         # Wrap the adapter so downstream code keeps the KV‑pointer logic
-        return NeuronHFAdapterWrap(adapter)
+        # (eval mode: these modules are only ever run for inference)
+        return NeuronHFAdapterWrap(adapter).eval()
     else:
+        if quantize == "int8":
+            # int8 weights are a Neuron LLaMA feature: quantizing this plain
+            # HF model would not make it usable by speculative_decode
+            logger.warning(f"quantize='int8' is only supported for Neuron LLaMA models; ignoring it for '{model_path}'.")
         model = AutoModelForCausalLM.from_pretrained(model_path)
         tokenizer = AutoTokenizer.from_pretrained(model_path, use_fast=False)
         if tokenizer.pad_token is None:
@@ -357,7 +400,7 @@ def compile_target_model(model_path: str,
     model.config.pad_token_id = hf_config.pad_token_id
 
     adapter = HuggingFaceGenerationModelAdapter(hf_config, model)
-    return NeuronHFAdapterWrap(adapter)
+    return NeuronHFAdapterWrap(adapter).eval()
 
 
 def load_target_model(model_path: str,
@@ -1,12 +1,48 @@
 import time
 import os
 import json
-import csv
-from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
 
+PERF_CSV_HEADER = "total_latency,tokens_generated,throughput,avg_token_time,token_match_rate\n"
+
+
+def _write_file(path: str, data: bytes):
+    """Replace `path` with `data`, normally in a single write syscall."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            # os.write may accept fewer bytes than offered; keep going
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
+def write_perf(csv_path: str, json_path: str, total_latency: float, tokens_generated: int,
+               throughput: float, avg_token_time: float, token_match_rate=None, extra: dict = None):
+    """
+    Write one metrics row (with header) to `csv_path` and the same metrics,
+    plus any `extra` fields, to `json_path`.  Each file is formatted into a
+    single buffer first and written in one go.
+    """
+    rate = token_match_rate if token_match_rate is not None else "N/A"
+    csv_payload = (PERF_CSV_HEADER +
+                   f"{total_latency:.6f},{tokens_generated},{throughput:.6f},{avg_token_time:.6f},{rate}\n")
+    _write_file(csv_path, csv_payload.encode())
+    metrics = {
+        "total_latency": total_latency,
+        "tokens_generated": tokens_generated,
+        "throughput": throughput,
+        "avg_token_time": avg_token_time,
+        "token_match_rate": token_match_rate,
+    }
+    if extra:
+        metrics.update(extra)
+    _write_file(json_path, json.dumps(metrics, indent=2).encode())
+
+
 class PerformanceProfiler:
     """
     PerformanceProfiler encapsulates methods for measuring and recording:
@@ -24,7 +60,7 @@ class PerformanceProfiler:
         self.total_latency = 0.0
 
     def start(self):
-        self.start_time = time.time()
+        self.start_time = time.perf_counter()
         self.token_times = []
         self.token_count = 0
         self.match_count = 0
@@ -39,7 +75,7 @@ class PerformanceProfiler:
 
     def finish(self):
         if self.start_time is not None:
-            self.total_latency = time.time() - self.start_time
+            self.total_latency = time.perf_counter() - self.start_time
         logger.debug(f"Profiling finished. Total latency: {self.total_latency:.4f} sec")
 
     def average_token_time(self):
@@ -60,43 +96,17 @@ class PerformanceProfiler:
         return None
 
     def export_metrics(self, role: str, output_dir: str = ".", filename_prefix: str = None):
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
         prefix = filename_prefix or role
         csv_filename = os.path.join(output_dir, f"{prefix}_performance_{timestamp}.csv")
         json_filename = os.path.join(output_dir, f"{prefix}_performance_{timestamp}.json")
 
-        avg_time = self.average_token_time()
-        tput = self.throughput()
-        rate = self.token_match_rate()
-
-        # CSV
-        try:
-            with open(csv_filename, "w", newline="") as csvfile:
-                writer = csv.writer(csvfile)
-                writer.writerow(["total_latency", "tokens_generated", "throughput", "avg_token_time", "token_match_rate"])
-                writer.writerow([
-                    f"{self.total_latency:.6f}",
-                    self.token_count,
-                    f"{tput:.6f}",
-                    f"{avg_time:.6f}",
-                    rate if rate is not None else "N/A"
-                ])
-            logger.info(f"Performance metrics saved to CSV: {csv_filename}")
-        except Exception as e:
-            logger.error(f"Failed to save CSV metrics: {e}")
-
-        # JSON
         try:
-            metrics = {
-                "total_latency": self.total_latency,
-                "tokens_generated": self.token_count,
-                "throughput": tput,
-                "avg_token_time": avg_time,
-                "per_token_times": self.token_times,
-                "token_match_rate": rate
-            }
-            with open(json_filename, "w") as jsonfile:
-                json.dump(metrics, jsonfile, indent=2)
-            logger.info(f"Performance metrics saved to JSON: {json_filename}")
+            write_perf(csv_filename, json_filename,
+                       self.total_latency, self.token_count,
+                       self.throughput(), self.average_token_time(),
+                       self.token_match_rate(),
+                       extra={"per_token_times": self.token_times})
+            logger.info(f"Performance metrics saved to {csv_filename} and {json_filename}")
         except Exception as e:
-            logger.error(f"Failed to save JSON metrics: {e}")
+            logger.error(f"Failed to save metrics: {e}")
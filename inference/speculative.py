@@ -1,4 +1,6 @@
-import random
+import math
+import time
+import functools
 import torch
 import logging
 import collections
@@ -9,7 +11,9 @@ logger = logging.getLogger(__name__)
 
 # Repetition‑penalty strength (0 < α ≤ 1).  Smaller → stronger penalty
 REP_PENALTY = 0.4
+LOG_REP_PENALTY = math.log(REP_PENALTY)
 NGRAM_WINDOW = 3    # penalise 1‑ to 3‑gram repeats
+TOPK_CAP = 512      # default top-k prefilter: nucleus is searched in the top-512
 if not logger.hasHandlers():
     h = logging.StreamHandler()
     h.setLevel(logging.INFO)
@@ -18,6 +22,103 @@ if not logger.hasHandlers():
     logger.addHandler(h)
     logger.setLevel(logging.INFO)
 
+def _repetition_mask(cand_idx, recent_ids):
+    """
+    Boolean mask over `cand_idx` marking candidates that would repeat a
+    1- to NGRAM_WINDOW-gram already present in `recent_ids`.
+    """
+    recent = torch.tensor(recent_ids, device=cand_idx.device)
+    mask = (cand_idx.unsqueeze(1) == recent).any(dim=1)
+    for n in range(2, NGRAM_WINDOW + 1):
+        if len(recent_ids) < n:
+            break
+        tail = recent[-(n - 1):]                          # last n-1 tokens
+        # [tail + candidate] for each candidate vs. every n-gram window
+        cand = torch.cat([tail.repeat(cand_idx.size(0), 1), cand_idx.unsqueeze(1)], dim=1)
+        windows = recent.unfold(0, n, 1)                  # (L-n+1, n)
+        mask |= (cand.unsqueeze(1) == windows).all(dim=2).any(dim=1)
+    return mask
+
+
+def _sample_token_id(logits, temperature, top_p, recent_ids=None, top_k=TOPK_CAP):
+    """
+    Sample one token from 1-D vocab `logits` with temperature, nucleus
+    (top-p) filtering and the n-gram repetition penalty against
+    `recent_ids`.  Returns (token_id, q) with q the token's probability under
+    the final, renormalised draft distribution.
+
+    Only the `top_k` largest logits are exponentiated; the softmax
+    normaliser comes from a single logsumexp, so no full-vocab probability
+    tensor is built.
+    A full sort is used only when the nucleus does not fit in the top-k.
+    The draw itself is Gumbel-max over the nucleus logits, so the penalised
+    distribution is never renormalised.
+    """
+    # bf16 logits are upcast once (in-place scale on the copy); the top-p
+    # cumsum needs more than bf16's 8 mantissa bits to place the cutoff
+    scaled = logits.to(torch.float32, copy=True).div_(temperature)
+    k = min(top_k, scaled.shape[-1])
+    lse = torch.logsumexp(scaled, dim=-1)
+    top_logits, top_idx = torch.topk(scaled, k)
+    # probabilities → running sum, all in one buffer (exp_/cumsum_ in place)
+    cum_p = top_logits.sub(lse).exp_().cumsum_(0)
+    if k < scaled.shape[-1] and cum_p[-1] < top_p:
+        # flat distribution: the nucleus extends past the top-k, fall back
+        # to a full sort so the cutoff stays exact
+        top_logits, top_idx = torch.sort(scaled, descending=True)
+        cum_p = top_logits.sub(lse).exp_().cumsum_(0)
+    cut = min(int(torch.searchsorted(cum_p, top_p, right=True)), cum_p.shape[0] - 1)
+    nucleus_idx    = top_idx[:cut + 1]
+    nucleus_scores = top_logits[:cut + 1]      # unnormalised log-weights
+
+    if recent_ids:
+        # no mask.any() readback: an all-False mask is a no-op update
+        mask = _repetition_mask(nucleus_idx, recent_ids)
+        nucleus_scores[mask] += LOG_REP_PENALTY   # view into top_logits; not reused
+
+    # Gumbel-max: argmax(score - log E), E ~ Exp(1), draws from
+    # softmax(score) without normalising; q needs one logsumexp
+    noise = torch.empty_like(nucleus_scores).exponential_().log_()
+    sample_idx = int(torch.argmax(noise.neg_().add_(nucleus_scores)))
+    q = torch.exp(nucleus_scores[sample_idx] - torch.logsumexp(nucleus_scores, dim=0))
+    return int(nucleus_idx[sample_idx]), float(q)
+
+
+def _accepted_prefix_len(target_probs, draft_probs, u=None):
+    """
+    Number of leading drafts accepted under the speculative sampling rule:
+    draft i is accepted if u_i·q_i < p_i, i.e. always when p_i ≥ q_i and
+    with probability p_i/q_i otherwise.  A missing or zero q_i falls back to
+    p_i ≥ 1e-3.  `u` holds one U[0,1) draw per draft (fresh ones if None);
+    draws after the first rejection are simply unused.
+    """
+    n = len(target_probs)
+    p = torch.tensor(target_probs, dtype=torch.float32)
+    q = torch.zeros(n, dtype=torch.float32)
+    n_q = min(n, len(draft_probs))
+    q[:n_q] = torch.tensor(draft_probs[:n_q], dtype=torch.float32)
+    if u is None:
+        u = torch.rand(n)
+    accept = torch.where(q > 0.0, u * q < p, p >= 1e-3)
+    rejected = (~accept).nonzero()
+    return int(rejected[0]) if rejected.numel() else n
+
+
+def _owns_draft_model(decode):
+    """
+    Run `decode` holding the draft model's session_lock.  A session owns the
+    batch-1 KV cache (and _primed_ids) from priming until it returns, so the
+    prefill skip can never trust slots another session is overwriting.
+    """
+    @functools.wraps(decode)
+    def locked(draft_model, *args, **kwargs):
+        with draft_model.session_lock:
+            return decode(draft_model, *args, **kwargs)
+    return locked
+
+
+@_owns_draft_model
+@torch.inference_mode()
 def speculative_decode(
     draft_model,
     tokenizer,
@@ -28,12 +129,17 @@ def speculative_decode(
     profile=False,
     top_p=0.9,
     temperature=1.0,
-    session_id=0
+    session_id=0,
+    prompt_ids=None,
+    top_k=TOPK_CAP
 ):
     """
     Perform probability-based speculative decoding using a draft model and a target model via gRPC,
     with full rollback of the draft model's past states.
-    Extended to handle a session_id so multiple prompts can run concurrently on the server.
+    Extended to handle a session_id so the server can tell sessions apart.
+    `prompt_ids` ((1, L) tensor) may be passed when the caller has already tokenized `prompt`.
+    `top_k` bounds the candidate set the top-p cutoff is searched in (exact
+    either way; a nucleus wider than top_k falls back to a full sort).
     """
     valid_gammas = (1, 2, 4, 8)   # must match compiled buckets on target
     # snap initial γ to the largest compiled bucket ≤ user request
@@ -52,33 +158,40 @@ def speculative_decode(
     draft_model._next_pos = 0  # next position index in the KV cache
 
     # pre-filling: Feed the entire prompt once so the draft model builds its KV cache
-    prompt_ids = tokenizer(prompt, return_tensors='pt').input_ids
+    if prompt_ids is None:
+        prompt_ids = tokenizer(prompt, return_tensors='pt').input_ids
     prev_token_id = int(prompt_ids[0, -1].item()) if prompt_ids.shape[-1] > 0 else tokenizer.bos_token_id
     
-    # Feed the prompt so Neuron caches 0…L‑1, then set pointer to NEXT index (=L)
-    if prompt_ids.shape[-1] > 0:
-       # build the KV cache for the prompt
-       _ = draft_model.forward(input_ids=prompt_ids)          # fills 0…L‑1
-       prompt_len = prompt_ids.shape[-1]
-       # Overwrite cache pointer with a single‑index tensor [L]
-       draft_model.cache_ids = torch.tensor([prompt_len], dtype=torch.int32)
-       draft_model._next_pos = prompt_len
+    # Invariant: the KV cache holds every token *except* prev_token_id, which
+    # the next draft step feeds at _next_pos.  So prime with the prompt minus
+    # its last token, caching 0…L‑2, and point at L‑1.
+    # Slots 0…len(_primed_ids)-1 still hold the previous session's primed
+    # prefix (decoding only writes past it), so a prompt whose prefix is
+    # already cached skips the prefill entirely.
+    prompt_len = prompt_ids.shape[-1]
+    prefix = tuple(prompt_ids[0, :-1].tolist())
+    primed = getattr(draft_model, "_primed_ids", ())
+    if prompt_len > 1:
+       if primed[:len(prefix)] != prefix:
+           _ = draft_model.forward(input_ids=prompt_ids[:, :-1])  # fills 0…L‑2
+       draft_model.cache_ids = torch.tensor([prompt_len - 1], dtype=torch.int32)
+       draft_model._next_pos = prompt_len - 1
     else:
-       # no prompt given
-       prompt_len = 0
+       # empty or single-token prompt: nothing to cache before prev_token_id
        draft_model.cache_ids = torch.tensor([0], dtype=torch.int32)
        draft_model._next_pos = 0
+    draft_model._primed_ids = prefix
 
     tokens_generated = 0
     # reusable scratch tensor (1,1) for single-token forwards
     scratch_token = torch.empty((1, 1), dtype=torch.int64)
     # fixed-size deque for fast repetition penalty history
     recent_deque  = collections.deque(maxlen=50)
+    eos_id = tokenizer.eos_token_id   # hoisted out of the token loops
     finished = False
     accepted_tokens_total = 0
     target_tokens_total = 0
 
-    import time
     # detailed timing metrics
     timing = {
         "draft_forward_time":       0.0,   # local draft forwards
@@ -86,14 +199,19 @@ def speculative_decode(
         "target_verification_time": 0.0,   # placeholder
         "rollback_time":            0.0,
     }
-    start_t = time.time()
+    start_ns = time.perf_counter_ns()
 
     while not finished and tokens_generated < max_new_tokens:
         # The draft model proposes up to 'gamma' tokens
         speculative_tokens = []
         speculative_probs = []
         logger.debug("[session=%s] Entering inner loop, tokens_generated=%d", session_id, tokens_generated)
-        past_states = [draft_model.cache_ids]
+        # Draft step j writes slot base_pos + j, so the rollback target is
+        # plain arithmetic on this one int; no per-step snapshots are kept
+        base_pos, base_prev = draft_model._next_pos, prev_token_id
+        # repetition-penalty history: committed tail + this round's drafts,
+        # built once per round and extended in place
+        history = list(recent_deque) if recent_deque else None
         for _ in range(current_gamma):
             scratch_token[0, 0] = prev_token_id
             if profile:
@@ -101,66 +219,17 @@ def speculative_decode(
             logits, _ = draft_model.forward(input_ids=scratch_token)
             if profile:
                 timing["draft_forward_time"] += time.perf_counter() - _t0
-            logits = logits.float()
-            # ---- Our improved numeric stability start ----
-            # Temperature‑scale logits then apply classic nucleus (top‑p) filter
-            logits = logits / current_temp
-            probs = torch.softmax(logits, dim=-1)
- 
-            # ---------- nucleus filter (fast top‑k) ----------
-            k = min(512, probs.shape[-1])          # limit sort to top‑512
-            top_vals, top_idx = torch.topk(probs, k)         # O(V) → O(k log k)
-            cum_p = torch.cumsum(top_vals, dim=0)
-            cut = torch.searchsorted(cum_p, top_p, right=True).item()
-            nucleus_idx   = top_idx[:cut + 1]
-            nucleus_probs = top_vals[:cut + 1]
-            nucleus_probs = nucleus_probs / nucleus_probs.sum()
-
-            # ---------- repetition penalty (1‑ to NGRAM_WINDOW‑gram) ----------
-            if recent_deque:
-                # Build a flat list of recent output + current draft chunk
-                recent_ids = list(recent_deque) + speculative_tokens
-                # Penalise 1‑gram repeats first
-                recent1 = torch.tensor(recent_ids, device=nucleus_idx.device)
-                mask1   = (nucleus_idx.unsqueeze(1) == recent1).any(dim=1)
-
-                # Optional higher‑order n‑gram penalty (up to NGRAM_WINDOW)
-                mask_ngram = mask1.clone()
-                if len(recent_ids) >= 2 and NGRAM_WINDOW >= 2:
-                    for n in range(2, NGRAM_WINDOW + 1):
-                        if len(recent_ids) < n:
-                            break
-                        tail = recent_ids[-(n-1):]                # last n‑1 tokens
-                        # create tensor [tail + candidate] for each nucleus candidate
-                        cand = torch.cat([
-                            torch.tensor(tail, device=nucleus_idx.device).repeat(nucleus_idx.size(0), 1),
-                            nucleus_idx.unsqueeze(1)
-                        ], dim=1)
-                        # search n‑gram occurrences in recent_ids as sliding window
-                        recent_ng = torch.tensor(recent_ids, device=nucleus_idx.device)
-                        windows = recent_ng.unfold(0, n, 1)       # shape (L-n+1, n)
-                        match = (cand.unsqueeze(1) == windows).all(dim=2).any(dim=1)
-                        mask_ngram |= match
-
-                if mask_ngram.any():
-                    nucleus_probs = torch.where(mask_ngram, nucleus_probs * REP_PENALTY, nucleus_probs)
-                    nucleus_probs = nucleus_probs / nucleus_probs.sum()
-            
-            # sample a token from the renormalised nucleus
-            sample_idx = torch.multinomial(nucleus_probs, 1).item()
-            token_id = int(nucleus_idx[sample_idx].item())
- 
-            token_prob = float(nucleus_probs[sample_idx].item())  # probability under q_draft
-            # ---- End numeric stability patch ----
+            token_id, token_prob = _sample_token_id(logits, current_temp, top_p, history, top_k)
+            if history is not None:
+                history.append(token_id)
 
             # store the token and its probability for later verification
             speculative_tokens.append(token_id)
             speculative_probs.append(token_prob)
             
             prev_token_id = token_id
-            past_states.append(draft_model.cache_ids.clone())   # pointer to next slot
             # Stop if end-of-sequence or max_new_tokens reached
-            if tokenizer.eos_token_id is not None and token_id == tokenizer.eos_token_id:
+            if eos_id is not None and token_id == eos_id:
                 finished = True
                 break
             if tokens_generated + len(speculative_tokens) >= max_new_tokens:
@@ -192,47 +261,71 @@ def speculative_decode(
             allowed_len = max(g for g in valid_gammas if g < len(speculative_tokens))
             speculative_tokens = speculative_tokens[:allowed_len]
             speculative_probs  = speculative_probs[:allowed_len]
-            past_states        = past_states[:allowed_len + 1]  # keep matching ptrs
+        # drafts whose KV is already written (d_1…d_fed); after a truncation
+        # every kept draft is, otherwise the last one has not been fed yet
+        fed = min(draft_model._next_pos - base_pos - 1, len(speculative_tokens))
+
         # --- Verify + commit in one RPC ---
-        commit_ids, accepted_count, target_finished = grpc_client.verify_draft_tokens(
+        if profile:
+            _t0 = time.perf_counter()
+        wait_verify = grpc_client.verify_draft_tokens_async(
             stub, speculative_tokens, speculative_probs, session_id=session_id
         )
+        # While the target verifies, feed the last draft so that every draft
+        # sent is in the cache; on a rejection its slot is past
+        # the rollback pointer and simply gets overwritten.
+        if fed < len(speculative_tokens):
+            scratch_token[0, 0] = speculative_tokens[-1]
+            if profile:
+                _tf = time.perf_counter()
+            _, _ = draft_model.forward(input_ids=scratch_token)
+            if profile:
+                # a draft forward, not RPC wait: count it there and move the
+                # verify window's start past it
+                _tf = time.perf_counter() - _tf
+                timing["draft_forward_time"] += _tf
+                _t0 += _tf
+            fed += 1
+        commit_ids, accepted_count, target_finished = wait_verify()
+        if profile:
+            timing["grpc_server_time"] += time.perf_counter() - _t0
         accepted_tokens_total += accepted_count
         target_tokens_total   += len(commit_ids) - accepted_count
 
         # --------------------------------------------------------------
-        # ROLLBACK draft KV pointer to the state *before* the first
-        # rejected token so we don't "leak" unused cache slots.
-        # past_states[0] is the pointer *before* emitting any speculative
-        # token; past_states[k] is after accepting k tokens.
+        # ROLLBACK draft KV pointer.  Slot base_pos holds prev_token_id and
+        # base_pos + j holds d_j.  Accepted drafts that were fed stay in the
+        # cache, so the rollback is a pointer reset; the last committed token
+        # becomes prev_token_id and is never counted as cached.  Every draft
+        # sent has been fed by now and the target commits at most one token
+        # past the accepted ones, so no committed token is left to catch up.
         # --------------------------------------------------------------
-        rollback_ptr = past_states[accepted_count].clone()
-        draft_model.cache_ids = rollback_ptr
-        draft_model._next_pos = int(rollback_ptr.item())
-
-        # Feed committed tokens back into the draft model (we have already
-        # rolled back the KV pointer to the correct slot). 
-        for tok in commit_ids:
-            scratch_token[0, 0] = tok
-            if profile:
-                _t0 = time.perf_counter()
-            _, _ = draft_model.forward(input_ids=scratch_token)
-            if profile:
-                timing["draft_forward_time"] += time.perf_counter() - _t0
-            draft_model.cache_ids = torch.tensor([draft_model._next_pos], dtype=torch.int32)
-            prev_token_id = tok
-            output_tokens.append(tok)
-            recent_deque.append(tok)
-            tokens_generated += 1
-            if tokenizer.eos_token_id is not None and tok == tokenizer.eos_token_id:
-                finished = True
+        if commit_ids:
+            cached = min(accepted_count, fed, len(commit_ids) - 1)
+            rollback_pos = base_pos + cached + 1
+        else:
+            cached = 0
+            rollback_pos = base_pos
+        draft_model.cache_ids = torch.tensor([rollback_pos], dtype=torch.int32)
+        draft_model._next_pos = rollback_pos
+
+        # bulk bookkeeping: one extend per container instead of a Python
+        # loop per committed token
+        output_tokens.extend(commit_ids)
+        recent_deque.extend(commit_ids)
+        tokens_generated += len(commit_ids)
+        if eos_id is not None and eos_id in commit_ids:
+            finished = True
+        prev_token_id = commit_ids[-1] if commit_ids else base_prev
 
         # Propagate server‑side finished flag
         finished = finished or target_finished
 
         # ---------- adaptive γ and temperature (P‑controller) ----------
         if current_gamma > 0:
-            loop_accept_rate = accepted_count / current_gamma
+            # rate over the drafts actually verified: a round cut short by
+            # EOS, max_new_tokens or bucket truncation sent fewer than γ
+            loop_accept_rate = accepted_count / len(speculative_tokens)
             error = target_accept - loop_accept_rate
 
             # PID suggestion
@@ -255,11 +348,10 @@ def speculative_decode(
             finished = True
 
     # Build final text
-    generated_text = tokenizer.decode(output_tokens[-tokens_generated:]) if output_tokens else ""
+    generated_text = tokenizer.decode(output_tokens) if output_tokens else ""
 
     # Performance stats
-    end_t = time.time()
-    total_time = end_t - start_t
+    total_time = (time.perf_counter_ns() - start_ns) / 1e9
     perf_stats = {}
     if profile:
         tokens_generated_total = accepted_tokens_total + target_tokens_total
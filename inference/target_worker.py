@@ -1,12 +1,13 @@
 import logging
+import threading
 import torch
 from concurrent import futures
 import grpc
 import time
 from inference import model_loader
 from transformers import AutoTokenizer
-from grpc_comm import inference_pb2, inference_pb2_grpc
-import random      # ← NEW
+from grpc_comm import inference_pb2, inference_pb2_grpc, grpc_client
+from inference.speculative import _sample_token_id, _accepted_prefix_len
 
 logger = logging.getLogger(__name__)
 if not logger.hasHandlers():
@@ -18,6 +19,10 @@ if not logger.hasHandlers():
     logger.setLevel(logging.INFO)
 
 class TargetSession:
+    # fixed attribute set: no per-session __dict__, faster attribute access
+    __slots__ = ("current_ids", "finished", "tokens_generated", "verification_time",
+                 "finalize_calls", "last_draft_chunk", "cache_ids")
+
     def __init__(self, input_ids):
         self.current_ids = input_ids  # Torch tensor [1, seq_len]
         self.finished = False
@@ -27,7 +32,6 @@ class TargetSession:
         self.last_draft_chunk = None
         # pointer to the *next* KV slot
         self.cache_ids = torch.tensor([input_ids.shape[1]], dtype=torch.int32)
-        self.pending_logits = None
 
 class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
     def __init__(self, model_path, sequence_length=128, spec_length=None, temperature: float = 1.0, top_p: float = 0.9):
@@ -39,7 +43,9 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         self.eos_token_id = self.tokenizer.eos_token_id
         self._ctx_estimate = sequence_length
         self.sessions = {}  # session_id -> TargetSession
-        self.lock = torch.multiprocessing.Lock()
+        # one model, one KV cache: RPC threads serialise on this.  A plain
+        # thread lock; nothing here is shared across processes.
+        self.lock = threading.Lock()
 
     # ------------------------------------------------------------------
     # Utility: right‑pad an (1, L) tensor with zeros to ctx_estimate
@@ -67,34 +73,46 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         return torch.cat([input_ids, pad], dim=1)
 
     def _sync_kv_pointer(self, sess: TargetSession):
+        # model.cache_ids is a clone of the session's, so one scalar read
+        # is enough (re-reading both to compare them cannot disagree)
         self.model.cache_ids = sess.cache_ids.clone()
         if hasattr(self.model, "_next_pos"):
-            self.model._next_pos = int(sess.cache_ids.item())
-        # ---- sanity check ----
-        assert int(self.model.cache_ids.item()) == int(sess.cache_ids.item()), \
-            "Target KV cache_ids desynchronised after sync"
+            self.model._next_pos = int(sess.cache_ids)
 
 
+    @torch.inference_mode()
     def StartGeneration(self, request, context):
         session_id = request.session_id
         prompt_text = request.prompt
         max_tokens = request.max_new_tokens
         gamma = request.gamma
-        logger.info(f"[session={session_id}] StartGeneration: prompt='{prompt_text}', max_new_tokens={max_tokens}, gamma={gamma}")
+        prompt_token_ids = grpc_client.unpack_token_ids(request.prompt_token_ids)
+        if prompt_token_ids:
+            logger.info(f"[session={session_id}] StartGeneration: prompt_len={len(prompt_token_ids)}, max_new_tokens={max_tokens}, gamma={gamma}")
+        else:
+            logger.info(f"[session={session_id}] StartGeneration: prompt='{prompt_text}', max_new_tokens={max_tokens}, gamma={gamma}")
         with self.lock:
             if session_id in self.sessions:
                 logger.warning(f"Session {session_id} already exists, overwriting.")
-            if prompt_text:
+            if prompt_token_ids:
+                # client sent pre-tokenized ids: skip server-side tokenization
+                current_ids = torch.tensor([prompt_token_ids], dtype=torch.long)
+            elif prompt_text:
                 enc = self.tokenizer(prompt_text, return_tensors='pt')
                 current_ids = enc["input_ids"]
             else:
-                current_ids = torch.zeros((1,0), dtype=torch.long)
+                current_ids = None
+            if current_ids is None or current_ids.shape[1] == 0:
+                # every target step reads the logits of the last context
+                # token, so a session needs at least one
+                logger.warning(f"[session={session_id}] StartGeneration: empty prompt, rejected.")
+                self.sessions.pop(session_id, None)
+                return inference_pb2.StartResponse(acknowledged=False)
             self.sessions[session_id] = TargetSession(current_ids)
             # --- prime Neuron KV cache on the prompt ---
             self.model.cache_ids = None
             self.model._next_pos = 0
-            if current_ids.shape[1] > 0:
-                _ = self.model.forward(current_ids)
+            _ = self.model.forward(current_ids)
             # store pointer (next index) inside the session
             self.sessions[session_id].cache_ids = torch.tensor(
                 [current_ids.shape[1]], dtype=torch.int32
@@ -104,6 +122,7 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
     # =============================
     # BATCH calls for multi‑seq
     # =============================
+    @torch.inference_mode()
     def VerifyBatchTokens(self, request, context):
         """
         Verify several session‑specific draft token chunks in one RPC.
@@ -116,12 +135,13 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         results = []
         with self.lock:
             for seq in request.sequences:
-                sid          = request.session_id
-                draft_tokens = list(request.draft_tokens)
-                draft_probs  = list(request.draft_probs) if hasattr(request, "draft_probs") else []
+                sid          = seq.session_id
+                draft_tokens = list(seq.draft_tokens)
+                draft_probs  = list(seq.draft_probs)
 
                 # 1) Session validation
-                if sid not in self.sessions:
+                sess = self.sessions.get(sid)
+                if sess is None:
                     logger.warning(f"[VerifyBatchTokens] Session {sid} not found.")
                     results.append(
                         inference_pb2.VerifyResult(
@@ -133,7 +153,6 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
                     )
                     continue
 
-                sess = self.sessions[sid]
                 if sess.finished:
                     results.append(
                         inference_pb2.VerifyResult(
@@ -177,26 +196,28 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         return inference_pb2.VerifyBatchResponse(results=results)
 
 
+    @torch.inference_mode()
     def FinalizeBatchTokens(self, request, context):
         results = []
+        eos_id = self.eos_token_id
         with self.lock:
             for seq in request.sequences:
                 sid = seq.session_id
                 tokens = list(seq.tokens)
-                if sid not in self.sessions:
+                sess = self.sessions.get(sid)
+                if sess is None:
                     logger.warning(f"Session {sid} not found in FinalizeBatchTokens.")
                     results.append(inference_pb2.FinalizeBatchResult(session_id=sid, finished=True))
                     continue
-                sess = self.sessions[sid]
                 if sess.finished:
                     results.append(inference_pb2.FinalizeBatchResult(session_id=sid, finished=True))
                     continue
 
-                # Accept these tokens into sess.current_ids
-                for t in tokens:
-                    new_tok = torch.tensor([[t]], dtype=sess.current_ids.dtype)
-                    sess.current_ids = torch.cat([sess.current_ids, new_tok], dim=1)
-                    if self.eos_token_id is not None and t == self.eos_token_id:
+                # Accept these tokens into sess.current_ids (one cat, not one per token)
+                if tokens:
+                    new_toks = torch.tensor([tokens], dtype=sess.current_ids.dtype)
+                    sess.current_ids = torch.cat([sess.current_ids, new_toks], dim=1)
+                    if eos_id is not None and eos_id in tokens:
                         sess.finished = True
                 results.append(inference_pb2.FinalizeBatchResult(session_id=sid, finished=sess.finished))
         return inference_pb2.FinalizeBatchResponse(results=results)
@@ -213,20 +234,13 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         if not draft_tokens:
             return []
 
-        # ----- snapshot current pointer & logits -----
+        # ----- snapshot current pointer -----
         orig_cache   = sess.cache_ids.clone()
-        orig_nextpos = int(orig_cache.item())
-        logits_next  = sess.pending_logits          # may be None
-        sess.pending_logits = None                  # consume
+        orig_nextpos = int(orig_cache)
 
         # ----- sync model → session -----
         self._sync_kv_pointer(sess)
 
-        # (1, N) tensor holding the whole draft chunk
-        draft_tensor = torch.tensor(
-            [draft_tokens], dtype=sess.current_ids.dtype
-        )
-
         # ---------- ONE model.forward ----------
         # Build (1, N) input_ids for the draft chunk
         n_new = len(draft_tokens)
@@ -263,43 +277,46 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         logits_all = logits_all[:n_new]
 
         # ---------- convert logits → probabilities for each draft token ----------
-        with torch.no_grad():
-            row_probs = torch.softmax(logits_all.float(), dim=-1)   # (N, V)
+        # upcast inside the kernel rather than materialising an fp32 copy
+        row_probs = torch.softmax(logits_all, dim=-1, dtype=torch.float32)   # (N, V)
+        # gather every P_target(d_i) with one indexing op and one host copy
+        tok_idx = torch.tensor(draft_tokens, dtype=torch.long)
         if row_probs.dim() == 1:
             vocab_len = row_probs.size(0)
             if vocab_len > max(draft_tokens):        # normal case → full vocab
-                probs = [float(row_probs[tok].item()) for tok in draft_tokens]
+                probs = row_probs[tok_idx].tolist()
             else:
                 # Fallback: model returned only N values (one per token).
                 # Treat them directly as P_target(draft_i | context).
-                probs = [float(row_probs[i].item()) for i in range(n_new)]
+                probs = row_probs[:n_new].tolist()
         else:
-            probs = [float(row_probs[i, tok].item()) for i, tok in enumerate(draft_tokens)]
-
-        # keep logits of the *last* position so next call can reuse them
-        sess.pending_logits = logits_all[-1].clone()
+            probs = row_probs[torch.arange(n_new), tok_idx].tolist()
 
         # ---------- restore snapshot ----------
         self.model.cache_ids = orig_cache.clone()
         if hasattr(self.model, "_next_pos"):
             self.model._next_pos = orig_nextpos
         sess.cache_ids = orig_cache
-        assert int(self.model.cache_ids.item()) == int(sess.cache_ids.item()), \
-            "KV desync detected on verify exit"
 
         return probs
 
+    def VerifyDraftTokensStream(self, request_iterator, context):
+        """Streaming VerifyDraftTokens: one response per request, in order."""
+        for request in request_iterator:
+            yield self.VerifyDraftTokens(request, context)
+
+    @torch.inference_mode()
     def VerifyDraftTokens(self, request, context):
         sid          = request.session_id
         draft_tokens = list(request.draft_tokens)
         draft_probs  = list(request.draft_probs) if hasattr(request, "draft_probs") else []
 
         with self.lock:
-            if sid not in self.sessions:
+            sess = self.sessions.get(sid)
+            if sess is None:
                 return inference_pb2.VerifyResponse(committed_ids=[],
                                                     accepted_count=0,
                                                     finished=True)
-            sess = self.sessions[sid]
             if sess.finished or not draft_tokens:
                 return inference_pb2.VerifyResponse(committed_ids=[],
                                                     accepted_count=0,
@@ -312,27 +329,25 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
             probs = self._verify_single_step(sess, draft_tokens)
 
             # --------------------------------------------------------------
-            # Probabilistic acceptance:
+            # Probabilistic acceptance, decided for the whole chunk at once:
             #   • if p_target ≥ q_draft   → accept with prob 1
             #   • else                    → accept with prob p_target / q_draft
             # --------------------------------------------------------------
-            for i, (tok, p_tgt) in enumerate(zip(draft_tokens, probs)):
-                q_draft = draft_probs[i] if i < len(draft_probs) else 0.0
+            n_chk = len(probs)
+            n_accept = _accepted_prefix_len(probs, draft_probs)
+
+            hit_eos = False
+            eos_id = self.eos_token_id
+            for tok in draft_tokens[:n_accept]:
+                accepted_cnt += 1
+                self._commit_token(sess, tok)
+                committed.append(tok)
+                if eos_id == tok:
+                    hit_eos = True
+                    break
 
-                if q_draft <= 0.0:  # fallback for missing/zero q
-                    accept = (p_tgt >= 1e-3)
-                elif p_tgt >= q_draft:
-                    accept = True
-                else:
-                    accept = random.random() < (p_tgt / q_draft)
-
-                if accept:
-                    accepted_cnt += 1
-                    self._commit_token(sess, tok)
-                    committed.append(tok)
-                    if self.eos_token_id == tok:
-                        break
-                else:
+            if not hit_eos:
+                if n_accept < n_chk:
                     # first rejection → commit a fallback token and stop
                     fallback = self._generate_one_token(
                         sess,
@@ -340,13 +355,12 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
                         top_p=self.top_p,
                     )
                     committed.append(fallback)
-                    break
-            else:
-                # all accepted → bonus token
-                bonus = self._generate_one_token(sess,
-                                                 temperature=self.temperature,
-                                                 top_p=self.top_p)
-                committed.append(bonus)
+                else:
+                    # all accepted → bonus token
+                    bonus = self._generate_one_token(sess,
+                                                     temperature=self.temperature,
+                                                     top_p=self.top_p)
+                    committed.append(bonus)
 
             return inference_pb2.VerifyResponse(committed_ids=committed,
                                                 accepted_count=accepted_cnt,
@@ -357,13 +371,15 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         tok = torch.tensor([[tok_id]], dtype=sess.current_ids.dtype)
         sess.current_ids = torch.cat([sess.current_ids, tok], dim=1)
         self._sync_kv_pointer(sess)
-        _, _ = self.model.forward(input_ids=tok,
-                                  cache_ids=torch.tensor([self.model._next_pos],
-                                                         dtype=torch.int32))
-        sess.cache_ids = torch.tensor([self.model._next_pos], dtype=torch.int32)
+        # no cache_ids: the wrapper writes _next_pos into its reused decode
+        # position tensor, and the session owns its pointer, so both update
+        # in place instead of allocating two (1,) tensors per token
+        _, _ = self.model.forward(input_ids=tok)
+        sess.cache_ids[0] = self.model._next_pos
         if self.eos_token_id == tok_id:
             sess.finished = True
 
+    @torch.inference_mode()
     def FinalizeTokens(self, request, context):
         sid              = request.session_id
         accepted_count   = request.accepted_count
@@ -371,11 +387,11 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
 
         with self.lock:
             # ---------- session checks ----------
-            if sid not in self.sessions:
+            sess = self.sessions.get(sid)
+            if sess is None:
                 logger.warning(f"Session {sid} not found.")
                 return inference_pb2.FinalizeResponse(final_token=0, finished=True)
 
-            sess = self.sessions[sid]
             if sess.finished:
                 return inference_pb2.FinalizeResponse(final_token=0, finished=True)
 
@@ -384,19 +400,14 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
             accepted = chunk[:accepted_count]
 
             # ---------- 1) commit accepted tokens ----------
+            eos_id = self.eos_token_id
             for t in accepted:
-                sess.current_ids = torch.cat(
-                    [sess.current_ids,
-                     torch.tensor([[t]], dtype=sess.current_ids.dtype)],
-                    dim=1)
+                tok = torch.tensor([[t]], dtype=sess.current_ids.dtype)
+                sess.current_ids = torch.cat([sess.current_ids, tok], dim=1)
                 self._sync_kv_pointer(sess)
-                lgts, _ = self.model.forward(
-                    input_ids=torch.tensor([[t]], dtype=sess.current_ids.dtype),
-                    cache_ids=torch.tensor([self.model._next_pos], dtype=torch.int32),
-                )
-                sess.pending_logits = lgts[0] if lgts.dim()==2 else lgts
-                sess.cache_ids = torch.tensor([self.model._next_pos], dtype=torch.int32)
-                if self.eos_token_id is not None and t == self.eos_token_id:
+                _, _ = self.model.forward(input_ids=tok)   # see _commit_token
+                sess.cache_ids[0] = self.model._next_pos
+                if eos_id is not None and t == eos_id:
                     sess.finished = True
 
             # ---------- 2) always generate ONE token from target ----------
@@ -415,8 +426,8 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
             # ---------- EOS handling ----------
             if (
                 fallback_token != 0
-                and self.eos_token_id is not None
-                and fallback_token == self.eos_token_id
+                and eos_id is not None
+                and fallback_token == eos_id
             ):
                 sess.finished = True
             # Log cumulative verification latency **once** when the session ends
@@ -437,8 +448,10 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
                     sid, sess.verification_time, sess.finalize_calls
                 )
 
-            token_text = self.tokenizer.decode([fallback_token]).strip() if fallback_token != 0 else "<none>"
-            logger.debug(f"[Finalize] returning token_id={fallback_token} ‹{token_text}› to draft model")
+            # the decode is only for the log line: skip it unless it is emitted
+            if logger.isEnabledFor(logging.DEBUG):
+                token_text = self.tokenizer.decode([fallback_token]).strip() if fallback_token != 0 else "<none>"
+                logger.debug("[Finalize] returning token_id=%d ‹%s› to draft model", fallback_token, token_text)
             return inference_pb2.FinalizeResponse(
                 final_token=fallback_token,
                 finished=sess.finished,
@@ -462,26 +475,23 @@ class SpeculativeServiceServicer(inference_pb2_grpc.SpeculativeServiceServicer):
         top_p       : float  (default = 0.9)
         """
         self._sync_kv_pointer(sess)
-        input_ids = sess.current_ids  # shape (1, L)
-        out_ids = self.model.sample(
-            input_ids,
-            sequence_length=input_ids.shape[1] + 1,
-            temperature=temperature,
-            top_p=top_p,
-            do_sample=True,
+        # Logits for the next token: re-feed the last context token into its
+        # own (already identical) KV slot.  generate() over sess.current_ids
+        # would re-prefill the whole context from slot 0 for one token.
+        last_pos = self.model._next_pos - 1
+        logits, _ = self.model.forward(
+            input_ids=sess.current_ids[:, -1:],
+            cache_ids=torch.tensor([last_pos], dtype=torch.int32)
         )
-
-        token_id = int(out_ids[0, -1].item())
+        token_id, _ = _sample_token_id(logits, temperature, top_p)
 
         # Advance KV cache inside the Neuron model to reflect the new token
-        _, _ = self.model.forward(
-            input_ids=torch.tensor([[token_id]], dtype=sess.current_ids.dtype),
-            cache_ids=torch.tensor([self.model._next_pos], dtype=torch.int32)
-        )
-        sess.cache_ids = torch.tensor([self.model._next_pos], dtype=torch.int32)
+        tok = torch.tensor([[token_id]], dtype=sess.current_ids.dtype)
+        _, _ = self.model.forward(input_ids=tok)   # see _commit_token
+        sess.cache_ids[0] = self.model._next_pos
 
         # Append token to context
-        sess.current_ids = out_ids
+        sess.current_ids = torch.cat([sess.current_ids, tok], dim=1)
         if self.eos_token_id is not None and token_id == self.eos_token_id:
             sess.finished = True
         sess.tokens_generated += 1
@@ -522,12 +532,30 @@ def _extract_logits_all(outputs):
         raise ValueError(f"Unhandled shape for model output: {out_t.shape}")
 
 
+# Match the draft-side channel: accept its keepalive pings (sent every 20 s)
+# without answering with GOAWAY/too_many_pings, and allow the same message size.
+SERVER_OPTIONS = [
+    ('grpc.max_send_message_length', 64 * 1024 * 1024),
+    ('grpc.max_receive_message_length', 64 * 1024 * 1024),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_ping_interval_without_data_ms', 10000),
+    ('grpc.http2.max_pings_without_data', 0),
+]
+
+# A VerifyDraftTokensStream holds one server thread for its whole session, so
+# cap in-flight RPCs at the pool size: one past the cap is refused with
+# RESOURCE_EXHAUSTED instead of queueing silently behind a live session.
+SERVER_MAX_WORKERS = 16
+
+
 def run_server(model_path, port=50051, sequence_length=128,
                spec_length=None, profile=False,
                temperature: float = 1.0, top_p: float = 0.9):
     logging.basicConfig(level=logging.INFO)
     logger.info(f"Loading target model from {model_path} seq_len={sequence_length}")
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=16))
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=SERVER_MAX_WORKERS),
+                         options=SERVER_OPTIONS,
+                         maximum_concurrent_rpcs=SERVER_MAX_WORKERS)
     servicer = SpeculativeServiceServicer(
         model_path,
         sequence_length=sequence_length,
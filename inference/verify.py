@@ -1,10 +1,9 @@
+import sys
 import time
 import logging
-import torch
 from transformers import AutoTokenizer
 from inference.model_loader import load_model
-import json
-from datetime import datetime
+from inference.performance_profile import write_perf
 
 logger = logging.getLogger(__name__)
 
@@ -17,10 +16,13 @@ def run_model(
     profile: bool = False,
     temperature: float = 1.0,
     top_p: float = 0.9,
+    verbose: bool = False,
 ):
     logger.info(f"Loading {role} model '{model_name}' for standalone generation (sequence_length={sequence_length})...")
     model = load_model(model_name, sequence_length=sequence_length)
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    # standalone run: nothing else has to tokenize identically, so take the
+    # fast (Rust) tokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
     if model is None:
         logger.error("Failed to load the model for verification.")
         return  # Exit early if model could not be loaded
@@ -29,61 +31,52 @@ def run_model(
         return
 
     logger.info(f"Starting generation for prompt: {prompt!r}")
-    start_time = time.time() if profile else None
+    start_ns = time.perf_counter_ns() if profile else None
+    # stamp the perf file names with the run start, computed once
+    ts = time.strftime('%Y%m%d_%H%M%S') if profile else None
     input_ids = tokenizer(prompt, return_tensors='pt').input_ids
-    output_text = ""
-    tokens_generated = 0
+    prompt_len = input_ids.shape[1]
+    eos_id = tokenizer.eos_token_id
 
-    for i in range(max_tokens):
-        # output = model.sample(input_ids, sequence_length=input_ids.shape[1] + 1)
-        output = model.sample(
-            input_ids,
-            sequence_length=input_ids.shape[1] + 1,
-            temperature=temperature,
-            top_p=top_p,
-        )
-        if isinstance(output, (list, tuple)):
-            token_id = int(output[0][-1])
-        else:
-            token_id = int(output[0, -1])
-
-        token_text = tokenizer.decode([token_id], clean_up_tokenization_spaces=True)
-        # print(f"Token {i+1}: {repr(token_text)}", flush=True)
-        output_text += token_text
-        new_token_tensor = torch.tensor([[token_id]], dtype=input_ids.dtype)
-        input_ids = torch.cat([input_ids, new_token_tensor], dim=1)
-        tokens_generated += 1
-
-        if tokenizer.eos_token_id is not None and token_id == tokenizer.eos_token_id:
-            logger.info("EOS token encountered, stopping generation.")
-            break
+    # All tokens come from ONE sample() call: generate() carries its KV
+    # cache through the new tokens, whereas a sample() per token re-prefills
+    # the whole context from slot 0 every step.
+    output = model.sample(
+        input_ids,
+        sequence_length=prompt_len + max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+    )
+    generated_ids = output[0, prompt_len:prompt_len + max_tokens].tolist()
+    if eos_id is not None and eos_id in generated_ids:
+        generated_ids = generated_ids[:generated_ids.index(eos_id) + 1]
+        logger.info("EOS token encountered, stopping generation.")
+    tokens_generated = len(generated_ids)
 
-    end_time = time.time()
+    if verbose:
+        # per-token echo goes straight to the raw stdout buffer, in one write
+        sys.stdout.buffer.write("".join(
+            f"Token {i+1}: {tokenizer.decode([token_id], clean_up_tokenization_spaces=True)!r}\n"
+            for i, token_id in enumerate(generated_ids)
+        ).encode())
+        sys.stdout.buffer.flush()
     total_time = 0.0
     if profile:
-        total_time = end_time - start_time
+        total_time = (time.perf_counter_ns() - start_ns) / 1e9
         throughput = tokens_generated / total_time if total_time > 0 else float('inf')
         logger.info(f"{role.capitalize()} model generation completed in {total_time:.2f} seconds.")
         logger.info(f"Tokens generated: {tokens_generated}, Throughput: {throughput:.2f} t/s")
-        csv_file = f"performance_{role}_only_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        csv_file = f"performance_{role}_only_{ts}.csv"
         json_file = csv_file.replace(".csv", ".json")
         try:
-            with open(csv_file, 'w', newline='') as f:
-                f.write("total_latency,tokens_generated,throughput,avg_token_time,token_match_rate\n")
-                avg_time = (total_time / tokens_generated) if tokens_generated > 0 else 0.0
-                f.write(f"{total_time:.6f},{tokens_generated},{throughput:.6f},{avg_time:.6f},N/A\n")
-            metrics = {
-                "total_latency": total_time,
-                "tokens_generated": tokens_generated,
-                "throughput": throughput,
-                "token_match_rate": None
-            }
-            with open(json_file, 'w') as f:
-                json.dump(metrics, f, indent=2)
+            avg_time = (total_time / tokens_generated) if tokens_generated > 0 else 0.0
+            write_perf(csv_file, json_file, total_time, tokens_generated, throughput, avg_time)
             logger.info(f"Performance metrics saved to {csv_file} and {json_file}")
         except Exception as e:
             logger.error(f"Failed to save profiling data: {e}")
 
+    # detokenize the whole continuation once
+    output_text = tokenizer.decode(generated_ids, clean_up_tokenization_spaces=True)
     full_output = prompt + output_text
     print("\n=== Final Output ===\n" + full_output)
     return full_output
@@ -100,6 +93,7 @@ if __name__ == "__main__":
     parser.add_argument("--profile", action="store_true", help="Enable total-time performance profiling")
     parser.add_argument("--role", type=str, default="target", choices=["target", "draft"],
                         help="Model role for logging (e.g. 'target' or 'draft')")
+    parser.add_argument("--verbose", action="store_true", help="Echo every generated token")
     args = parser.parse_args()
     run_model(
         args.model,
@@ -110,4 +104,5 @@ if __name__ == "__main__":
         profile=args.profile,
         temperature=args.temperature,
         top_p=args.top_p,
+        verbose=args.verbose,
     )
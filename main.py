@@ -1,8 +1,6 @@
 import argparse
 import logging
 import os
-from inference.model_loader import load_model
-from inference.draft_worker import save_perf_stats
 # Enable Transformer optimizations *and* expose past_key_values to Python
 os.environ["NEURON_CC_FLAGS"] = "--model-type=transformer"
 os.environ["NEURON_RT_NUM_CORES"] = "2"
@@ -54,6 +52,8 @@ def main():
                         help="Top-p for draft sampling (default 0.9)")
     parser.add_argument("--temperature", type=float, default=1.0,
                         help="Temperature for draft sampling (default 1.0)")
+    parser.add_argument("--verbose", action="store_true",
+                        help="(verify roles) Echo every generated token")
     args = parser.parse_args()
 
 
@@ -84,12 +84,8 @@ def main():
         # If the user provided --prompt_text, we'll run concurrency with multiple prompts
         if args.prompt_text:
             # Batch mode: multiple prompts from file, each in a separate gRPC session
+            # run_batched_prompt_file loads (and caches) the draft model
             from inference import draft_worker
-            draft_model = load_model(
-                draft_model,
-                sequence_length=args.sequence_length,
-                spec_length=args.gamma
-            )
             draft_worker.run_batched_prompt_file(
                 draft_model_name=draft_model,
                 target_host=args.target_host,
@@ -123,12 +119,14 @@ def main():
             profile=args.profile,
             temperature=args.temperature,
             top_p=args.top_p,
+            verbose=args.verbose,
         )
         if isinstance(res, tuple) and len(res) == 2:
             output_text, perf_stats = res
         else:
             output_text, perf_stats = res, None
         if args.profile and perf_stats:
+            from inference.draft_worker import save_perf_stats
             save_perf_stats(perf_stats, file_prefix="performance_verify_target")
 
     elif args.role == "verify_draft":
@@ -143,12 +141,14 @@ def main():
             prompt=prompt_text,
             max_tokens=args.max_new_tokens,
             sequence_length=args.sequence_length,
-            role="draft", profile=args.profile)
+            role="draft", profile=args.profile,
+            verbose=args.verbose)
         if isinstance(res, tuple) and len(res) == 2:
             output_text, perf_stats = res
         else:
             output_text, perf_stats = res, None
         if args.profile and perf_stats:
+            from inference.draft_worker import save_perf_stats
             save_perf_stats(perf_stats, file_prefix="performance_verify_draft")
     else:
         logger.error("Unknown role. Use --role target|draft|verify_target|verify_draft.")
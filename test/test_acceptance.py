@@ -0,0 +1,53 @@
+import random
+import torch
+from inference.speculative import _accepted_prefix_len
+
+
+def per_token_accept(target_probs, draft_probs, u):
+    # the original one-draft-at-a-time rule VerifyDraftTokens used
+    for i, p_tgt in enumerate(target_probs):
+        q_draft = draft_probs[i] if i < len(draft_probs) else 0.0
+        if q_draft <= 0.0:
+            accept = (p_tgt >= 1e-3)
+        elif p_tgt >= q_draft:
+            accept = True
+        else:
+            accept = u[i] < (p_tgt / q_draft)
+        if not accept:
+            return i
+    return len(target_probs)
+
+
+def test_matches_per_token_rule():
+    rng = random.Random(0)
+    for _ in range(2000):
+        n = rng.choice([1, 2, 4, 8])
+        # float32-exact values so both rules see the same numbers
+        p = torch.rand(n).tolist()
+        q = torch.rand(n).tolist()
+        u = torch.rand(n)
+        for i in range(n):
+            r = rng.random()
+            if r < 0.1:
+                q[i] = 0.0                 # zero q → p >= 1e-3 fallback
+            elif r < 0.2:
+                p[i] = 1e-4                # tiny p: rejected unless q is tinier
+        q = q[:rng.randint(0, n)]          # missing trailing q's
+        assert _accepted_prefix_len(p, q, u) == per_token_accept(p, q, u.tolist())
+
+
+def test_first_rejection_index():
+    u = torch.tensor([0.5, 0.5, 0.5, 0.5])
+    # p >= q always accepts, whatever u is
+    assert _accepted_prefix_len([0.9, 0.9, 0.9, 0.9], [0.5, 0.5, 0.5, 0.5], u) == 4
+    # 0.5·0.5 < 0.3 accepts; 0.5·0.8 < 0.3 does not → stop at index 1
+    assert _accepted_prefix_len([0.3, 0.3, 0.9, 0.9], [0.5, 0.8, 0.5, 0.5], u) == 1
+    # a rejection at 0 rejects the whole chunk, even if later drafts pass
+    assert _accepted_prefix_len([0.1, 0.9], [0.9, 0.1], u[:2]) == 0
+
+
+def test_missing_and_zero_q_fall_back_to_p_threshold():
+    u = torch.ones(3)                      # would reject any p < q
+    assert _accepted_prefix_len([0.5, 0.5, 0.5], [], u) == 3
+    assert _accepted_prefix_len([0.5, 1e-4, 0.5], [0.0, 0.0, 0.0], u) == 1
+    assert _accepted_prefix_len([0.5, 0.5, 1e-4], [0.0], u) == 2
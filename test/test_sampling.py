@@ -0,0 +1,97 @@
+import collections
+import random
+from unittest import mock
+import torch
+from inference.speculative import _sample_token_id, _repetition_mask, REP_PENALTY, NGRAM_WINDOW
+
+
+def repeats_ngram(cand, recent_ids):
+    # candidate repeats a 1- to NGRAM_WINDOW-gram of recent_ids
+    for n in range(1, NGRAM_WINDOW + 1):
+        if len(recent_ids) < n:
+            break
+        gram = recent_ids[len(recent_ids) - (n - 1):] + [cand]
+        if any(recent_ids[i:i + n] == gram for i in range(len(recent_ids) - n + 1)):
+            return True
+    return False
+
+
+def reference_distribution(logits, temperature, top_p, recent_ids=None):
+    """The penalised nucleus distribution, built the slow and obvious way."""
+    probs = torch.softmax(logits.double() / temperature, dim=-1)
+    sorted_p, sorted_idx = torch.sort(probs, descending=True)
+    cum = torch.cumsum(sorted_p, 0)
+    cut = min(int(torch.searchsorted(cum, top_p, right=True)), len(cum) - 1)
+    dist = {}
+    for p, idx in zip(sorted_p[:cut + 1].tolist(), sorted_idx[:cut + 1].tolist()):
+        if recent_ids and repeats_ngram(idx, recent_ids):
+            p *= REP_PENALTY
+        dist[idx] = p
+    total = sum(dist.values())
+    return {idx: p / total for idx, p in dist.items()}
+
+
+def check_against_reference(logits, temperature, top_p, recent_ids=None, top_k=512, n=20000):
+    ref = reference_distribution(logits, temperature, top_p, recent_ids)
+    counts = collections.Counter()
+    for _ in range(n):
+        tok, q = _sample_token_id(logits, temperature, top_p, recent_ids, top_k)
+        assert tok in ref, "sampled outside the nucleus"
+        assert abs(q - ref[tok]) < 1e-5
+        counts[tok] += 1
+    for tok, p in ref.items():
+        assert abs(counts[tok] / n - p) < 0.02, (tok, counts[tok] / n, p)
+
+
+def test_matches_reference_distribution():
+    torch.manual_seed(0)
+    logits = torch.randn(40) * 2
+    check_against_reference(logits, 1.0, 0.9)
+    check_against_reference(logits, 0.7, 0.8)
+
+
+def test_matches_reference_with_repetition_penalty():
+    torch.manual_seed(1)
+    logits = torch.randn(40) * 2
+    top = torch.topk(logits, 6).indices.tolist()
+    # penalise a few likely candidates as 1-, 2- and 3-gram repeats
+    recent = [top[0], top[1], 39, top[1], top[2], 38, top[1], top[2]]
+    check_against_reference(logits, 1.0, 0.95, recent)
+
+
+def test_bf16_logits_are_upcast():
+    torch.manual_seed(2)
+    logits = (torch.randn(40) * 2).to(torch.bfloat16)
+    ref = reference_distribution(logits.float(), 1.0, 0.9)
+    for _ in range(200):
+        tok, q = _sample_token_id(logits, 1.0, 0.9)
+        assert abs(q - ref[tok]) < 1e-5
+
+
+def test_full_sort_only_when_topk_mass_is_below_top_p():
+    torch.manual_seed(3)
+    flat = torch.randn(64) * 0.1          # the top 4 hold well under 90%
+    with mock.patch("inference.speculative.torch.sort", wraps=torch.sort) as spy:
+        check_against_reference(flat, 1.0, 0.9, top_k=4, n=5000)
+        assert spy.called
+    peaked = torch.full((64,), -10.0)
+    peaked[:3] = torch.tensor([5.0, 4.0, 3.0])
+    with mock.patch("inference.speculative.torch.sort", wraps=torch.sort) as spy:
+        _sample_token_id(peaked, 1.0, 0.9, top_k=4)
+        assert not spy.called
+
+
+def test_repetition_mask_flags_ngram_repeats():
+    recent = [5, 6, 7, 6, 7]
+    cand = torch.tensor([5, 6, 7, 8, 9])
+    # 5, 6 and 7 all occur (1-gram); [7, 6] and [6, 7, 6] are also 2-/3-gram
+    # repeats of windows in `recent`; 8 and 9 are new
+    assert _repetition_mask(cand, recent).tolist() == [True, True, True, False, False]
+    assert _repetition_mask(torch.tensor([1, 2]), [2]).tolist() == [False, True]
+
+    rng = random.Random(0)
+    for _ in range(500):
+        recent = [rng.randrange(8) for _ in range(rng.randint(1, 12))]
+        cand = torch.tensor(rng.sample(range(10), 6))
+        expect = [repeats_ngram(c, recent) for c in cand.tolist()]
+        assert _repetition_mask(cand, recent).tolist() == expect
@@ -1,10 +1,17 @@
 import random
+import threading
+import torch
+from grpc_comm import inference_pb2
 from inference import speculative
 
 class DummyTokenizer:
     def __init__(self, vocab_size=1000, eos_token_id=None):
         self.vocab_size = vocab_size
         self.eos_token_id = eos_token_id
+        self.bos_token_id = 1
+    def __call__(self, text, return_tensors=None):
+        # every prompt is the single BOS token
+        return type('DummyEncoding', (), {'input_ids': torch.tensor([[self.bos_token_id]])})
     def decode(self, token_ids):
         # Convert a list of token IDs to a space-separated string for testing
         return " ".join(str(t) for t in token_ids)
@@ -13,90 +20,179 @@ class DummyDraftModel:
     def __init__(self, tokenizer):
         self.tokenizer = tokenizer
         self.call_count = 0
-    def __call__(self, input_ids=None, use_cache=False, past_key_values=None):
+        self.cache_ids = None
+        self._next_pos = 0
+        self._primed_ids = ()
+        self.session_lock = threading.Lock()
+    def forward(self, input_ids, cache_ids=None):
         # Return logits that make certain tokens highly probable in sequence
         vocab = self.tokenizer.vocab_size
-        logits = -1e9 * torch.ones((1, 1, vocab))
+        logits = -1e9 * torch.ones(vocab)
         if self.call_count == 0:
             # First token: token 10 very likely, token 11/12 somewhat likely
-            logits[0, 0, 10] = 5.0
-            logits[0, 0, 11] = 1.0
-            logits[0, 0, 12] = 1.0
+            logits[10] = 5.0
+            logits[11] = 1.0
+            logits[12] = 1.0
         elif self.call_count == 1:
             # Second token: token 11 very likely (to simulate a potential rejection scenario)
-            logits[0, 0, 11] = 5.0
-            logits[0, 0, 12] = 1.0
+            logits[11] = 5.0
+            logits[12] = 1.0
         else:
             # Third token (if reached): token 12 very likely
-            logits[0, 0, 12] = 5.0
+            logits[12] = 5.0
         self.call_count += 1
-        # Create a dummy output object with required attributes
-        return type('DummyOutput', (), {
-            'logits': logits,
-            'past_key_values': None
-        })
+        self._next_pos += input_ids.shape[1]
+        return logits, None
 
-class DummyVerifyResponse:
-    def __init__(self, probs, finished):
-        self.target_probs = probs
-        self.finished = finished
+class _Reply:
+    def __init__(self, response):
+        self.response = response
+    def result(self):
+        return self.response
 
-class DummyFinalizeResponse:
-    def __init__(self, token, finished):
-        self.final_token = token
-        self.finished = finished
+class _UnaryCall:
+    """Stands in for a unary stub method: callable, with .future()."""
+    def __init__(self, handler):
+        self.handler = handler
+    def __call__(self, request):
+        return self.handler(request)
+    def future(self, request):
+        return _Reply(self.handler(request))
 
 class DummyStub:
     def __init__(self):
         self.verify_called = False
-        self.finalize_called = False
         self.last_request_size = 0
-        # Predefined behavior for target probabilities
-        self.prob_map = {}  # not used in this simple dummy, we'll hardcode in method
-    def VerifyDraftTokens(self, request):
+        self.last_draft_probs = []
+        self.VerifyDraftTokens = _UnaryCall(self._verify)
+    def _verify(self, request):
+        # Plays the target: verify the chunk, then commit the accepted
+        # prefix plus one target token, all in this one call.
         self.verify_called = True
-        # Simulate target probabilities for each draft token
         draft_tokens = list(request.draft_tokens)
+        draft_probs = list(request.draft_probs)
         self.last_request_size = len(draft_tokens)
+        self.last_draft_probs = draft_probs
         # Example: make token 10 highly probable (0.9), token 11 very low (0.05), token 12 moderate (0.5)
-        probs = []
-        for t in draft_tokens:
-            if t == 10:
-                probs.append(0.9)
-            elif t == 11:
-                probs.append(0.05)
-            elif t == 12:
-                probs.append(0.5)
+        target_probs = {10: 0.9, 11: 0.05, 12: 0.5}
+        committed = []
+        for t, q in zip(draft_tokens, draft_probs):
+            p = target_probs.get(t, 0.5)
+            if p >= q or random.random() < p / q:
+                committed.append(t)
             else:
-                # default moderate probability
-                probs.append(0.5)
-        finished = False  # in this test, target doesn't finish during verify
-        return DummyVerifyResponse(probs, finished)
-    def FinalizeTokens(self, request):
-        self.finalize_called = True
-        accepted_count = request.accepted_count
-        final_token = 0
-        finished = False
-        if accepted_count < self.last_request_size:
-            # A rejection happened; provide a target token as replacement
-            final_token = 13  # dummy token id generated by target
-            finished = False
-        # If accepted_count == last_request_size, no token needed (final_token remains 0)
-        return DummyFinalizeResponse(final_token, finished)
+                break
+        accepted = len(committed)
+        if accepted < len(draft_tokens):
+            committed.append(13)  # dummy token id generated by target
+        return inference_pb2.VerifyResponse(committed_ids=committed,
+                                            accepted_count=accepted,
+                                            finished=False)
 
 def test_speculative_acceptance():
     random.seed(0)  # Seed random for reproducibility
+    torch.manual_seed(0)
     tokenizer = DummyTokenizer()
     draft_model = DummyDraftModel(tokenizer)
     stub = DummyStub()
     # Perform speculative decoding with dummy components
-    output_text = speculative.speculative_decode(
-        draft_model, tokenizer, stub,
+    output_text, _ = speculative.speculative_decode(
+        draft_model, tokenizer, stub, "prompt",
         max_new_tokens=2, gamma=3, top_p=0.9
     )
     # The draft model would propose tokens [10, 11, ...]; target likely rejects token 11 and replaces with 13.
     # So the output sequence should be "10 13".
     assert output_text.strip() == "10 13"
-    # Verify that gRPC calls were made
+    # Verify that the gRPC call was made with both drafts and their q's
     assert stub.verify_called is True
-    assert stub.finalize_called is True
\ No newline at end of file
+    assert stub.last_request_size == 2
+    assert stub.last_draft_probs == [1.0, 1.0]
+
+
+# ----------------------------------------------------------------------
+# Draft KV cache bookkeeping
+# ----------------------------------------------------------------------
+VOCAB = 50
+
+class PositionRecordingModel:
+    """Records which token id was written to each KV slot."""
+    def __init__(self):
+        self.cache = {}
+        self.cache_ids = None
+        self._next_pos = 0
+        self._primed_ids = ()
+        self.session_lock = threading.Lock()
+    def forward(self, input_ids, cache_ids=None):
+        for j, tok in enumerate(input_ids[0].tolist()):
+            self.cache[self._next_pos + j] = tok
+        self._next_pos += input_ids.shape[1]
+        return torch.randn(VOCAB), None
+
+class RandomTarget:
+    """
+    Accepts a random prefix of every chunk and commits it with or without a
+    target token (or, now and then, commits nothing), checking the draft
+    cache on every call.
+    """
+    def __init__(self, model, context, rng):
+        self.model = model
+        self.context = list(context)      # every committed token so far
+        self.rng = rng
+        self.truncated = 0
+        self.empty = 0
+        self.VerifyDraftTokens = _UnaryCall(self._verify)
+    def _verify(self, request):
+        drafts = list(request.draft_tokens)
+        # Slots 0…len(context)-2 hold the context minus its last token, that
+        # token sits in the next slot (it was fed by the first draft step),
+        # then d_1…d_{n-1} follow; d_n may still be in flight.
+        seq = self.context + drafts
+        n_checked = len(self.context) + len(drafts) - 1
+        assert self.model._next_pos >= n_checked
+        assert [self.model.cache[i] for i in range(n_checked)] == seq[:n_checked]
+        if self.model._next_pos > n_checked + 1:
+            self.truncated += 1           # drafted past the bucket we were sent
+        if self.rng.random() < 0.1:
+            self.empty += 1
+            return inference_pb2.VerifyResponse(committed_ids=[], accepted_count=0, finished=False)
+        accepted = self.rng.randint(0, len(drafts))
+        committed = drafts[:accepted]
+        if accepted < len(drafts) or self.rng.random() < 0.7:
+            committed.append(self.rng.randrange(VOCAB))
+        self.context += committed
+        return inference_pb2.VerifyResponse(committed_ids=committed,
+                                            accepted_count=accepted,
+                                            finished=False)
+
+def test_draft_cache_holds_committed_sequence_minus_last_token():
+    rng = random.Random(0)
+    truncated = empty = 0
+    for trial in range(300):
+        torch.manual_seed(trial)
+        model = PositionRecordingModel()
+        tokenizer = DummyTokenizer(vocab_size=VOCAB, eos_token_id=rng.choice([None, 0]))
+        prompt = torch.randint(2, VOCAB, (1, rng.randint(0, 6)))
+        # two sessions on one model: the second sometimes shares the
+        # first's prompt prefix and skips its prefill
+        for session in range(2):
+            if session and rng.random() < 0.5:
+                prompt = torch.cat([prompt, torch.randint(2, VOCAB, (1, rng.randint(0, 2)))], dim=1)
+            elif session:
+                prompt = torch.randint(2, VOCAB, (1, rng.randint(0, 6)))
+            context = prompt[0].tolist() or [tokenizer.bos_token_id]
+            target = RandomTarget(model, context, rng)
+            text, _ = speculative.speculative_decode(
+                model, tokenizer, target, "prompt",
+                rng.randint(1, 30), rng.choice([1, 2, 4, 8]),
+                session_id=session, prompt_ids=prompt,
+            )
+            # the output is exactly what the target committed
+            assert text.split() == [str(t) for t in target.context[len(context):]]
+            # whatever is cached at the end is a prefix of context[:-1]
+            n = model._next_pos
+            assert n <= len(target.context) - 1
+            assert [model.cache[i] for i in range(n)] == target.context[:n]
+            truncated += target.truncated
+            empty += target.empty
+    # the random runs did exercise bucket truncation and empty commits
+    assert truncated > 0 and empty > 0